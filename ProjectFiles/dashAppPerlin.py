@@ -1,19 +1,69 @@
 # Author: Jose Martinez-Ponce
 # Date: Sat. Nov. 16
 # Purpose: Dash App to incorporate everything together
-from dash import Dash, html, dcc, Input, Output, callback, State, callback_context
+from dash import Dash, html, dcc, Input, Output, callback, State, callback_context, DiskcacheManager, no_update
+from dash.exceptions import PreventUpdate
 from datetime import datetime
-import plotly.express as px
+from functools import lru_cache
 import numpy as np
 import base64 # needed to decode files from DASH input
+import os
+import warnings
 
 
-from perlinMapGen import PerlinMap
+from perlinMapGen import mapCache
 from FileProcess import PerlinFile
+from noiseEngine import layerCache
+from exportCache import ExportCache, exportCache, exportKey
 
 
 # **IMPORTANT: MUST NEED pycollada, NetworkX, trimesh, scipy Packages in order for Export feature to work **
 
+# Generation and export run as background callbacks: jobs are run in worker processes through a disk cache,
+# so the server stays responsive, reports the progress of each stage and cancels stale jobs.
+# Without the diskcache extra (pip install "dash[diskcache]"), they run in the request thread as before.
+background_callbacks = []
+
+
+def background_callback(*args, progress=None, cancel=None, **kwargs):
+    # Keep a background callback, registered by create_app with the job manager of the app,
+    # or as a plain one without it; the function always receives set_progress first.
+    def decorator(function):
+        background_callbacks.append((function, args, dict(kwargs, progress=progress, cancel=cancel)))
+        return function
+    return decorator
+
+
+def background_manager():
+    # Job manager of the app, built on first use so that importing the module writes nothing.
+    try:
+        import diskcache
+        return DiskcacheManager(diskcache.Cache("./dash-jobs"))
+    except ImportError as error:
+        warnings.warn(f"Generation and export run in the request thread, install dash[diskcache] to run them as jobs ({error})")
+        return None
+
+
+def register_background_callbacks(app, background):
+    for function, args, kwargs in background_callbacks:
+        if background:
+            app.callback(*args, background=True, **kwargs)(function)
+            continue
+        kwargs = {name: value for name, value in kwargs.items() if name not in ("progress", "cancel")}
+
+        def run(*values, function=function):
+            return function(lambda value: None, *values)
+        run.__name__ = function.__name__
+        app.callback(*args, **kwargs)(run)
+
+
+# Parameter inputs of the advanced options: editing one shows a preview, then the full map
+parameter_inputs = ['seed-input-1', 'seed-input-2', 'octave-input-1', 'octave-input-2', 'size-input']
+
+# Stages reported by the progress bars
+generate_stages = ["Generating noise...", "Thresholding the map..."]
+export_stages = {"map": "Generating the map...", "mesh": "Building the mesh...", "write": "Writing the files..."}
+
 # I made the seeds global because otherwise the seeds wouldn't sync across
 global_seed1 = None
 global_seed2 = None
@@ -38,26 +88,59 @@ initOct1 = 20  # cannot be a non-positive num or none
 initOct2 = 20
 initSize = 500
 
-# Start Time Counter
-initStartTime = datetime.now()
+# The initial map has fixed seeds: it is generated on the first run only, then loaded from its file
+initSeed1, initSeed2 = 11, 1021
+initParams = {
+    'size': initSize,
+    'seed1': initSeed1,
+    'seed2': initSeed2,
+    'oct1': initOct1,
+    'oct2': initOct2,
+}
 
-# Init Map Generation
-perlin_map = PerlinMap(size=initSize, seed1=global_seed1, seed2=global_seed2, oct1=initOct1, oct2=initOct2)
-perlinMapGen, seed = perlin_map.generate_perlin()
 
-map2D = perlin_map.display_2d()
-map3D = perlin_map.display_3d()
+# Disk budget of the saved maps, in bytes
+MAP_STORE_BYTES = 2**30
+
+
+@lru_cache(maxsize=None)
+def folder_map_store(directory):
+    return ExportCache(directory, MAP_STORE_BYTES)
+
+
+def map_store():
+    # Generated maps are saved under maps/ in the current folder, each one in an entry named after its parameters
+    # and the version of the code, so it is never stale; least recently used ones are removed beyond the budget.
+    # update_graph saves each map there: it may run in a job process, whose memory is lost when it ends.
+    return folder_map_store(os.path.join(os.getcwd(), "maps"))
+
+
+def map_path(params):
+    # File of the saved map, marked as used, or None
+    return map_store().get(exportKey(params))
+
+
+def save_map(perlin_map, params):
+    # Save the map (generating it if needed), unless another process saved it first
+    def build(folder):
+        path = os.path.join(folder, "map.npz")
+        perlin_map.save(path)
+        return path
+    return map_store().fetch(exportKey(params), build, params)[0]
+
+
+def published_map(params):
+    # Map saved by update_graph (or generated and saved now), loaded once per process
+    path = map_path(params)
+    perlin_map = mapCache.get(path=path, **params)
+    if path is None:
+        save_map(perlin_map, params)
+    return perlin_map
+
+
+def initial_map():
+    return published_map(initParams)
 
-# End Time Counter
-initEndTime = datetime.now()
-initTimeTaken = (initEndTime - initStartTime).total_seconds()
-initMessage = f"""
-    Map generated in *{initTimeTaken:.2f}* seconds.\n
-    **Seed:** {seed}\n
-    **Map Size:** {initSize}\n
-    **Octave 1:** {initOct1}\n
-    **Octave 2:** {initOct2}\n
-    """
 
 explainMessage = f"""
     **Seed**: A numerical input that initializes the random number generator used to create the Perlin noise. Allows for 
@@ -68,7 +151,17 @@ explainMessage = f"""
     add finer details whereas lower octaves contribute to coarser details. \n
 """
 
-hardwareMessage = "**Note:** If you experience lag with the 3D Map, " \
+# Style of the 3D panel while shown
+panel_style = {
+    'display': 'flex',
+    'height': '800px',
+    'justifyContent': 'center',
+    'alignItems': 'center'
+}
+
+hardwareMessage = "**Note:** The 3D Map shows a reduced version of large maps. Zoom on the 2D Map " \
+                  "to see that region in full detail in the 3D Map, double-click it to go back. " \
+                  "If you experience lag with the 3D Map, " \
                   "turning on Hardware Acceleration for your browser removes the lag from the 3D Map. "
 
 file_upload_message = """
@@ -91,352 +184,345 @@ size: 300
 **Note:** Files that do not use this format may result in processing errors.
 """
 
-print("Map has been generated")
-fig = px.imshow(perlinMapGen, color_continuous_scale='gray')  # assigns the perlin map
-fig2 = map2D  # shows the generated perlin map into a 2D Map
-fig3 = map3D  # map3D already made into figure in perlinMapGen.py, no need to do imshow
-fig.update_layout(
-    # Set Title of Graph
-    title={
-        'text': "Perlin Noise",
-        'y': 0.95,
-        'x': 0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'
-    },
-    coloraxis_showscale=False  # Remove gradient bar on the side, not needed
-)
-
-fig2.update_layout(
-    title={
-        'text': "2D Map of Perlin Noise",
-        'y': 0.95,
-        'x': 0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'
-    },
-    coloraxis_showscale=False
-)
+def serve_layout():
+    # Layout built at each page load (not at import): the initial map is loaded from its file,
+    # generated on the first run only, and its figures are rendered like in the callbacks below
+    start_time = datetime.now()
+    perlin_map = initial_map()
+    perlin_map.pmap
+    time_taken = (datetime.now() - start_time).total_seconds()
+    init_message = f"""
+    Map loaded in *{time_taken:.2f}* seconds.\n
+    **Seed:** {perlin_map.get_seed()}\n
+    **Map Size:** {initSize}\n
+    **Octave 1:** {initOct1}\n
+    **Octave 2:** {initOct2}\n
+    """
+    fig = render_perlin(initParams)
+    fig2 = render_2d(initParams)
+    map3D, _ = render_3d(initParams, ["show_3d"])
+    return page_layout(fig, fig2, map3D, init_message)
 
-fig3.update_layout(
-    title={
-        'text': "3D Map of Perlin Noise",
-        'y': 0.95,
-        'x': 0.5,
-        'xanchor': 'center',
-        'yanchor': 'top',
-    },
-    scene=dict(
-        aspectratio=dict(x=1, y=1, z=0.5),  # Aspect Ratio
-        camera=dict(
-            eye=dict(x=0.5, y=0.5, z=1)  # How Close camera is
-        )
-    ),
-    margin=dict(l=0, r=0, t=50, b=0,),  # Controls White Space around graph
-    height=700,  # Controls Height of graph
-    width=700,
-)
 
-app = Dash()
-
-app.layout = html.Div(
-    id="main-div",
-    children=[
-        html.Div([
-            html.Label("Theme:"),
-            dcc.RadioItems(
-                id="theme-toggle",
-                options=[
-                    {"label": "Light Mode", "value": "light"},
-                    {"label": "Dark Mode", "value": "dark"}
-                ],
-                value="light",  # Default value is light mode
-                inline=True,
-                style={
-                    "marginLeft": "10px",
-                    "display": "inline-block",
-                    "fontSize": "16px"
-                }
-            )
-        ], style={"marginBottom": "10px", "textAlign": "left"}),
-
-        html.H1(
-            children='Perlin Noise Generator',
-            id="main-title",
-        ),
-
-        # Description
-        html.Div(
-            children=[
-                html.P(
-                    '''
-                    Perlin noise is a type of gradient noise used in computer graphics and procedural 
-                    generation to create smooth, natural-looking textures and patterns. It was developed 
-                    by Ken Perlin in 1983 to improve the visual complexity of computer-generated imagery.
-                    '''
+def page_layout(fig=None, fig2=None, map3D=None, init_message=""):
+    # Components of the page. Without figures, it is the quick validation layout of create_app
+    return html.Div(
+        id="main-div",
+        children=[
+            html.Div([
+                html.Label("Theme:"),
+                dcc.RadioItems(
+                    id="theme-toggle",
+                    options=[
+                        {"label": "Light Mode", "value": "light"},
+                        {"label": "Dark Mode", "value": "dark"}
+                    ],
+                    value="light",  # Default value is light mode
+                    inline=True,
+                    style={
+                        "marginLeft": "10px",
+                        "display": "inline-block",
+                        "fontSize": "16px"
+                    }
                 )
-            ],
-            style={'marginBottom': '20px'}
-        ),
-
-        # Message container
-        dcc.Markdown(
-            id='explain-message',
-            children=explainMessage,
-            style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
-        ),
-
-        dcc.Markdown(
-            id='format-upload-message',
-            children=file_upload_message,
-            style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
-        ),
-
-        dcc.Markdown(
-            id='message',
-            children=initMessage,
-            style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
-        ),
-
-
-        # Checkbox to enable Advanced Options
-        html.Div([
-            dcc.Checklist(
-                options=[
-                    {"label": "Show Advanced Options", "value": "show_advanced"}
+            ], style={"marginBottom": "10px", "textAlign": "left"}),
+
+            html.H1(
+                children='Perlin Noise Generator',
+                id="main-title",
+            ),
+
+            # Description
+            html.Div(
+                children=[
+                    html.P(
+                        '''
+                        Perlin noise is a type of gradient noise used in computer graphics and procedural 
+                        generation to create smooth, natural-looking textures and patterns. It was developed 
+                        by Ken Perlin in 1983 to improve the visual complexity of computer-generated imagery.
+                        '''
+                    )
                 ],
-                value=[],
-                id="toggle-advanced",
-                inline=True,
-            )
-        ], style={'textAlign': 'left', 'marginBottom': '20px'}),
-
-        # Buttons for generating and exporting
-        html.Div([
+                style={'marginBottom': '20px'}
+            ),
+
+            # Message container
+            dcc.Markdown(
+                id='explain-message',
+                children=explainMessage,
+                style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
+            ),
+
+            dcc.Markdown(
+                id='format-upload-message',
+                children=file_upload_message,
+                style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
+            ),
+
+            dcc.Markdown(
+                id='message',
+                children=init_message,
+                style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
+            ),
+
+
+            # Checkbox to enable Advanced Options
             html.Div([
-                html.Button(
-                    'Generate Random Perlin Map',
-                    id='generate-random-button',
-                    n_clicks=0,
-                    style={'marginRight': '20px'}
-                ),
-                dcc.Store(id='random-trigger', data=False),
-            ]),
+                dcc.Checklist(
+                    options=[
+                        {"label": "Show Advanced Options", "value": "show_advanced"}
+                    ],
+                    value=[],
+                    id="toggle-advanced",
+                    inline=True,
+                )
+            ], style={'textAlign': 'left', 'marginBottom': '20px'}),
+
+            # Buttons for generating and exporting
             html.Div([
-                html.Button(
-                    'Export Map',
-                    id='export-mesh-button',
-                    n_clicks=0,
-                    style={'marginRight': '20px'},
-                ),
                 html.Div([
-                    dcc.Loading(
-                        id='loading-export',
-                        type="circle",
-                        children=[
-                            html.Div(id='export-message')
-                        ]
-                    )
+                    html.Button(
+                        'Generate Random Perlin Map',
+                        id='generate-random-button',
+                        n_clicks=0,
+                        style={'marginRight': '20px'}
+                    ),
+                    dcc.Store(id='random-trigger', data=False),
                 ]),
-            ]),
-            html.Div([
-               html.Label("Upload Parameter File:"),
-               dcc.Upload(
-                   id="upload-file",
-                   children=html.Div(["Drag and Drop or ", html.A("Select a File")]),
-                   style={
-                        "width": "100%",
-                        "height": "60px",
-                        "lineHeight": "60px",
-                        "borderWidth": "1px",
-                        "borderStyle": "dashed",
-                        "borderRadius": "5px",
-                        "textAlign": "center",
-                        "marginBottom": "20px",
-                   },
-                   multiple=False  # prevent multiple uploads at the same time
-               ),
-                html.Div(id="upload-message")
-            ])
-
-        ], style={
-            'display': 'flex',
-            'flexDirection': 'row',
-            'justifyContent': 'center',
-            'alignItems': 'center',
-            'marginBottom': '20px'
-        }),
-
-        # Flex container for input fields and graph
-        html.Div([
-            html.Div(
-                id='advanced-options',
-                children=[
-                    # Seed Input 1
-                    html.Div([
-                        html.Label("Seed 1:"),
-                        dcc.Input(
-                            id='seed-input-1',
-                            type='number',
-                            value=global_seed1,
-                            step=1,
-                            placeholder="Enter Seed 1 Value",
-                            debounce=True,
-                            style={'width': '150px'}
-                        )
-                    ], style={
-                        'display': 'flex',
-                        'flexDirection': 'column',
-                        'marginBottom': '10px'
-                    }),
-                    # Seed Input 2
-                    html.Div([
-                        html.Label("Seed 2:"),
-                        dcc.Input(
-                            id='seed-input-2',
-                            type='number',
-                            value=global_seed2,
-                            step=1,
-                            placeholder="Enter Seed 2 Value",
-                            debounce=True,
-                            style={'width': '150px'}
-                        )
-                    ], style={
-                        'display': 'flex',
-                        'flexDirection': 'column',
-                        'marginBottom': '10px'
-                    }),
-                    # Octave 1 Input
-                    html.Div([
-                        html.Label("Octave 1:"),
-                        dcc.Input(
-                            id='octave-input-1',
-                            type='number',
-                            value=initOct1,
-                            step=1,
-                            placeholder="Enter Octave 1 Value",
-                            debounce=True,
-                            style={'width': '150px'}
-                        )
-                    ], style={
-                        'display': 'flex',
-                        'flexDirection': 'column',
-                        'marginBottom': '10px'
-                    }),
-                    # Octave 2 Input
-                    html.Div([
-                        html.Label("Octave 2:"),
-                        dcc.Input(
-                            id='octave-input-2',
-                            type='number',
-                            value=initOct2,
-                            step=1,
-                            placeholder="Enter Octave 2 Value",
-                            debounce=True,
-                            style={'width': '150px'}
-                        )
-                    ], style={
-                        'display': 'flex',
-                        'flexDirection': 'column',
-                        'marginBottom': '10px'
-                    }),
-                    # Size Input
+                html.Div([
+                    html.Button(
+                        'Export Map',
+                        id='export-mesh-button',
+                        n_clicks=0,
+                        style={'marginRight': '20px'},
+                    ),
                     html.Div([
-                        html.Label("Size:"),
-                        dcc.Input(
-                            id='size-input',
-                            type='number',
-                            value=initSize,
-                            step=1,
-                            placeholder="Enter Size",
-                            debounce=True,
-                            style={'width': '150px'}
+                        dcc.Loading(
+                            id='loading-export',
+                            type="circle",
+                            children=[
+                                html.Div(id='export-message')
+                            ]
                         )
-                    ], style={
-                        'display': 'flex',
-                        'flexDirection': 'column',
-                        'marginBottom': '10px'
-                    }),
-                    # Generate Perlin Map Button
-                    html.Div([
-                        html.Button(
-                            'Generate Perlin Map',
-                            id='generate-manual-button',
-                            n_clicks=0,
-                            style={'marginBottom': '20px'}
-                        ),
-                        dcc.Store(id='manual-trigger', data=False),
                     ]),
-                    html.Div([
-                        html.P(
-                            '''
-                            Note: Maps are only displayed in square dimensions
-                            ''',
-                            style={'width': '150px', 'marginTop': '10px'}
-                        )
-                    ], style={
-                        'display': 'flex',
-                        'flexDirection': 'column',
-                        'marginBottom': '10px'
-                    }),
-                ]
-            ),
-
-            html.Div([
-                # Graph 1: Perlin Noise
+                    html.Progress(id='export-progress', value='0', max='3'),
+                    html.Div(id='export-status'),
+                ]),
                 html.Div([
-                    dcc.Loading(
-                        id="loading-1",
-                        type="default",
-                        children=dcc.Graph(id='Perlin-Graph', figure=fig),
-                        style={'height': '400px', 'width': '400px'}
+                    html.Button(
+                        'Cancel',
+                        id='cancel-button',
+                        n_clicks=0,
+                        style={'marginRight': '20px'},
                     ),
-                ], style={'textAlign': 'center', 'margin': '10px'}),
+                    html.Progress(id='generate-progress', value='0', max=str(len(generate_stages))),
+                    html.Div(id='generate-status'),
+                ]),
+                html.Div([
+                   html.Label("Upload Parameter File:"),
+                   dcc.Upload(
+                       id="upload-file",
+                       children=html.Div(["Drag and Drop or ", html.A("Select a File")]),
+                       style={
+                            "width": "100%",
+                            "height": "60px",
+                            "lineHeight": "60px",
+                            "borderWidth": "1px",
+                            "borderStyle": "dashed",
+                            "borderRadius": "5px",
+                            "textAlign": "center",
+                            "marginBottom": "20px",
+                       },
+                       multiple=False  # prevent multiple uploads at the same time
+                   ),
+                    html.Div(id="upload-message")
+                ])
+
+            ], style={
+                'display': 'flex',
+                'flexDirection': 'row',
+                'justifyContent': 'center',
+                'alignItems': 'center',
+                'marginBottom': '20px'
+            }),
+
+            # Flex container for input fields and graph
+            html.Div([
+                html.Div(
+                    id='advanced-options',
+                    children=[
+                        # Seed Input 1
+                        html.Div([
+                            html.Label("Seed 1:"),
+                            dcc.Input(
+                                id='seed-input-1',
+                                type='number',
+                                value=global_seed1,
+                                step=1,
+                                placeholder="Enter Seed 1 Value",
+                                debounce=True,
+                                style={'width': '150px'}
+                            )
+                        ], style={
+                            'display': 'flex',
+                            'flexDirection': 'column',
+                            'marginBottom': '10px'
+                        }),
+                        # Seed Input 2
+                        html.Div([
+                            html.Label("Seed 2:"),
+                            dcc.Input(
+                                id='seed-input-2',
+                                type='number',
+                                value=global_seed2,
+                                step=1,
+                                placeholder="Enter Seed 2 Value",
+                                debounce=True,
+                                style={'width': '150px'}
+                            )
+                        ], style={
+                            'display': 'flex',
+                            'flexDirection': 'column',
+                            'marginBottom': '10px'
+                        }),
+                        # Octave 1 Input
+                        html.Div([
+                            html.Label("Octave 1:"),
+                            dcc.Input(
+                                id='octave-input-1',
+                                type='number',
+                                value=initOct1,
+                                step=1,
+                                placeholder="Enter Octave 1 Value",
+                                debounce=True,
+                                style={'width': '150px'}
+                            )
+                        ], style={
+                            'display': 'flex',
+                            'flexDirection': 'column',
+                            'marginBottom': '10px'
+                        }),
+                        # Octave 2 Input
+                        html.Div([
+                            html.Label("Octave 2:"),
+                            dcc.Input(
+                                id='octave-input-2',
+                                type='number',
+                                value=initOct2,
+                                step=1,
+                                placeholder="Enter Octave 2 Value",
+                                debounce=True,
+                                style={'width': '150px'}
+                            )
+                        ], style={
+                            'display': 'flex',
+                            'flexDirection': 'column',
+                            'marginBottom': '10px'
+                        }),
+                        # Size Input
+                        html.Div([
+                            html.Label("Size:"),
+                            dcc.Input(
+                                id='size-input',
+                                type='number',
+                                value=initSize,
+                                step=1,
+                                placeholder="Enter Size",
+                                debounce=True,
+                                style={'width': '150px'}
+                            )
+                        ], style={
+                            'display': 'flex',
+                            'flexDirection': 'column',
+                            'marginBottom': '10px'
+                        }),
+                        # Generate Perlin Map Button
+                        html.Div([
+                            html.Button(
+                                'Generate Perlin Map',
+                                id='generate-manual-button',
+                                n_clicks=0,
+                                style={'marginBottom': '20px'}
+                            ),
+                            dcc.Store(id='manual-trigger', data=False),
+                        ]),
+                        html.Div([
+                            html.P(
+                                '''
+                                Note: Maps are only displayed in square dimensions
+                                ''',
+                                style={'width': '150px', 'marginTop': '10px'}
+                            )
+                        ], style={
+                            'display': 'flex',
+                            'flexDirection': 'column',
+                            'marginBottom': '10px'
+                        }),
+                    ]
+                ),
 
-                # Graph 2: 2D Map
                 html.Div([
-                    dcc.Loading(
-                        id="loading-2",
-                        type="default",
-                        children=dcc.Graph(id='2D-Perlin-Map', figure=fig2),
-                        style={'height': '400px', 'width': '400px'}
-                    ),
-                ], style={'textAlign': 'center', 'margin': '10px'}),
+                    # Graph 1: Perlin Noise
+                    html.Div([
+                        dcc.Loading(
+                            id="loading-1",
+                            type="default",
+                            children=dcc.Graph(id='Perlin-Graph', figure=fig),
+                            style={'height': '400px', 'width': '400px'}
+                        ),
+                    ], style={'textAlign': 'center', 'margin': '10px'}),
+
+                    # Graph 2: 2D Map
+                    html.Div([
+                        dcc.Loading(
+                            id="loading-2",
+                            type="default",
+                            children=dcc.Graph(id='2D-Perlin-Map', figure=fig2),
+                            style={'height': '400px', 'width': '400px'}
+                        ),
+                    ], style={'textAlign': 'center', 'margin': '10px'}),
+                ], style={
+                    'display': 'flex',
+                    'alignItems': 'flex-start'
+                }),
             ], style={
                 'display': 'flex',
-                'alignItems': 'flex-start'
+                'alignItems': 'flex-start',
+                'justifyContent': 'center'
             }),
-        ], style={
-            'display': 'flex',
-            'alignItems': 'flex-start',
-            'justifyContent': 'center'
-        }),
-
-        # Graph 3: 3D Map (can be in separate container)
-        html.Div([
-            dcc.Loading(
-                id="loading-3",
-                type="default",
-                children=dcc.Graph(id='3D-Perlin-Map', figure=map3D),
-                style={'height': '800px', 'width': '80%', 'margin': '0 auto'}
+
+            # Graph 3: 3D Map (can be in separate container), only built while shown
+            html.Div([
+                dcc.Checklist(
+                    options=[
+                        {"label": "Show 3D Map", "value": "show_3d"}
+                    ],
+                    value=["show_3d"],
+                    id="toggle-3d",
+                    inline=True,
+                )
+            ], style={'textAlign': 'left', 'marginBottom': '20px'}),
+
+            html.Div([
+                dcc.Loading(
+                    id="loading-3",
+                    type="default",
+                    children=dcc.Graph(id='3D-Perlin-Map', figure=map3D),
+                    style={'height': '800px', 'width': '80%', 'margin': '0 auto'}
+                ),
+            ], id='3d-panel', style=panel_style),
+
+            dcc.Markdown(
+                id='hardware-message',
+                children=hardwareMessage,
+                style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
             ),
-        ], style={
-            'display': 'flex',
-            'height': '800px',
-            'justifyContent': 'center',
-            'alignItems': 'center'
-        }),
-
-        dcc.Markdown(
-            id='hardware-message',
-            children=hardwareMessage,
-            style={'textAlign': 'left', 'marginBottom': '20px', 'fontSize': '16px'}
-        ),
-
-        dcc.Store(id='perlin-map-object'),
-    ],
-    style={'padding': '10px'}
-)
+
+            # Parameters of the displayed map, which stays on the server (see stored_map)
+            dcc.Store(id='perlin-map-object', data=initParams),
+        ],
+        style={'padding': '10px'}
+    )
 
 
 # Function to help generate random params for generate button
@@ -451,10 +537,8 @@ def generate_random_params():
 
 
 # Callback for initial perlin noise
-@callback(
-    Output('Perlin-Graph', 'figure'),
-    Output('2D-Perlin-Map', 'figure'),
-    Output('3D-Perlin-Map', 'figure'),
+# A new click on a generate button cancels the job still running, as does the cancel button
+@background_callback(
     Output('message', 'children'),
     Output('random-trigger', 'data'),
     Output('manual-trigger', 'data'),
@@ -465,23 +549,25 @@ def generate_random_params():
         Input('generate-random-button', 'n_clicks'),
         Input('generate-manual-button', 'n_clicks'),
         Input("upload-file", "contents"),
+        # seed1, seed2, oct1, oct2, size need to be the last 5 inputs
+        # Editing them generates the map too, after the preview (see render_preview)
+        Input('seed-input-1', 'value',),
+        Input('seed-input-2', 'value'),
+        Input('octave-input-1', 'value'),
+        Input('octave-input-2', 'value'),
+        Input('size-input', 'value'),
     ],
     [
-        # seed1, seed2, oct1, oct2, size need to be first 5 states
-        State('seed-input-1', 'value',),
-        State('seed-input-2', 'value'),
-        State('octave-input-1', 'value'),
-        State('octave-input-2', 'value'),
-        State('size-input', 'value'),
         State('random-trigger', 'data'),
         State('manual-trigger', 'data'),
     ],
 
-    prevent_initial_call=True
-
+    prevent_initial_call=True,
+    progress=[Output('generate-progress', 'value'), Output('generate-status', 'children')],
+    cancel=[Input('cancel-button', 'n_clicks')],
 )
 # TODO: Figure out why it takes 10 seconds to generate map, should be shorter
-def update_graph(rand_n_clicks, man_n_clicks, file_contents, seed1, seed2, oct1, oct2, size, random_trigger, manual_trigger):
+def update_graph(set_progress, rand_n_clicks, man_n_clicks, file_contents, seed1, seed2, oct1, oct2, size, random_trigger, manual_trigger):
     # rand_n_clicks and man_n_clicks needed in order to check if button is pressed
 
     # Starts Timer
@@ -524,6 +610,13 @@ def update_graph(rand_n_clicks, man_n_clicks, file_contents, seed1, seed2, oct1,
             random_trigger = False
             manual_trigger = True
 
+        elif triggered_id in parameter_inputs:
+            # Edited parameter: wait until every field is filled
+            if None in [seed1, seed2, oct1, oct2, size]:
+                raise PreventUpdate
+            random_trigger = False
+            manual_trigger = True
+
         # print(f"seed1={seed1}, seed2={seed2}, oct1={oct1}, oct2={oct2}, size={size}") # debug
 
     map_state = {
@@ -539,49 +632,33 @@ def update_graph(rand_n_clicks, man_n_clicks, file_contents, seed1, seed2, oct1,
     # Update the global seed vars
     seed1, seed2 = update_seeds(seed1, seed2)
 
-    # Call the function from perlinMapgen.py
-    # Creates the Perlin Noise
-    updated_perlin_map = PerlinMap(size=size, seed1=seed1, seed2=seed2, oct1=oct1, oct2=oct2)
-    updatedPerlinMap, gener_seed = updated_perlin_map.generate_perlin()
-
-    # Creates Perlin Noise
-    fig1 = px.imshow(updatedPerlinMap, color_continuous_scale='gray')
-    fig1.update_layout(
-         # Set Title of Graph
-         title={
-             'text': "Perlin Noise",
-             'y': 0.95,
-             'x': 0.5,
-             'xanchor': 'center',
-             'yanchor': 'top'
-         },
-         coloraxis_showscale=False  # Remove gradient bar on the side, not needed
-     )
-
-    new_fig2 = updated_perlin_map.display_2d()
-    new_fig2.update_layout(
-         title={
-             'text': "2D Perlin Map",
-             'y': 0.95,
-             'x': 0.5,
-             'xanchor': 'center',
-             'yanchor': 'top'
-         },
-         coloraxis_showscale=False
-     )
-
-    new_fig3 = updated_perlin_map.display_3d()
-    new_fig3.update_layout(
-         title={
-             'text': "3D Perlin Map",
-             'y': 0.95,
-             'x': 0.5,
-             'xanchor': 'center',
-             'yanchor': 'top'
-         }
-     )
+    perlin_map_data = {
+        'size': size,
+        'seed1': seed1,
+        'seed2': seed2,
+        'oct1': oct1,
+        'oct2': oct2,
+    }
 
+    # Call the function from perlinMapgen.py
+    # The map comes from the cache of this process when these parameters were seen before, or from its file
+    path = map_path(perlin_map_data)
+    updated_perlin_map = mapCache.get(path=path, **perlin_map_data)
+    gener_seed = updated_perlin_map.get_seed()
+    set_progress((str(0), generate_stages[0]))
+    updated_perlin_map.perlin
+    set_progress((str(1), generate_stages[1]))
+    updated_perlin_map.pmap
+    # Saved before the store is updated: the callbacks rendering the figures load it from there
+    # instead of generating it again, when this callback runs in a job process
+    if path is None:
+        save_map(updated_perlin_map, perlin_map_data)
+
+    # The figures are rendered by their own callbacks, once the map is published in the store below
     print("Map Updated!")  # Debug print statement
+    print(f"Layer cache: {layerCache.stats()}")  # hit/miss counters, to size the cache
+    print(f"Map cache: {mapCache.stats()}")
+    set_progress((str(len(generate_stages)), "Map ready."))
     end_time = datetime.now()  # End the timer
     time_taken = (end_time - start_time).total_seconds()
     print(f"Final seed used in the message: {gener_seed}")  # debug
@@ -594,15 +671,115 @@ def update_graph(rand_n_clicks, man_n_clicks, file_contents, seed1, seed2, oct1,
      **Octave 2:** {oct2} \n
      """
 
-    perlin_map_data = {
-        'size': size,
-        'seed1': seed1,
-        'seed2': seed2,
-        'oct1': oct1,
-        'oct2': oct2,
-    }
+    return message, random_trigger, manual_trigger, perlin_map_data, upload_message
+
+
+# Coarse preview of the 2D map, shown at once while the full map is generated by update_graph
+@callback(
+    Output('2D-Perlin-Map', 'figure', allow_duplicate=True),
+    Input('generate-manual-button', 'n_clicks'),
+    [Input(input_id, 'value') for input_id in parameter_inputs],
+
+    prevent_initial_call=True
+)
+def render_preview(man_n_clicks, seed1, seed2, oct1, oct2, size):
+    if None in [seed1, seed2, oct1, oct2, size]:
+        return no_update
+    preview_map = mapCache.get(size=size, seed1=seed1, seed2=seed2, oct1=oct1, oct2=oct2)
+    # Maps seen before are shown in full resolution straight away by render_2d
+    if preview_map.is_generated():
+        return no_update
+    return titled(preview_map.display_preview(), "2D Perlin Map (preview)")
+
+
+def stored_map(perlin_map_data):
+    # Map published in the store: the store only holds its parameters, the map itself
+    # stays on the server, saved by update_graph and then kept in the cache of each process
+    if not perlin_map_data:
+        return initial_map()
+    return published_map({name: perlin_map_data[name] for name in initParams})
+
+
+def titled(figure, title):
+    # Copy, so that the title does not leak into the figure cached with the map
+    import plotly.graph_objects as go
+    figure = go.Figure(figure)
+    figure.update_layout(
+        title={
+            'text': title,
+            'y': 0.95,
+            'x': 0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        }
+    )
+    return figure
+
+
+# Callbacks rendering each figure from the published map: the 2D figures do not wait for the 3D one
+@callback(
+    Output('Perlin-Graph', 'figure'),
+    Input('perlin-map-object', 'data'),
+
+    prevent_initial_call=True
+)
+def render_perlin(perlin_map_data):
+    return titled(stored_map(perlin_map_data).display_perlin(), "Perlin Noise")
 
-    return fig1, new_fig2, new_fig3, message, random_trigger, manual_trigger, perlin_map_data, upload_message
+
+@callback(
+    Output('2D-Perlin-Map', 'figure'),
+    Input('perlin-map-object', 'data'),
+
+    prevent_initial_call=True
+)
+def render_2d(perlin_map_data):
+    return titled(stored_map(perlin_map_data).display_2d(), "2D Perlin Map")
+
+
+# The 3D figure is only built while its panel is shown, when it is opened otherwise
+@callback(
+    Output('3D-Perlin-Map', 'figure'),
+    Output('3d-panel', 'style'),
+    Input('perlin-map-object', 'data'),
+    Input('toggle-3d', 'value'),
+
+    prevent_initial_call=True
+)
+def render_3d(perlin_map_data, toggle_value):
+    if "show_3d" not in toggle_value:
+        return no_update, dict(panel_style, display='none')
+    return titled(stored_map(perlin_map_data).display_3d(), "3D Perlin Map"), panel_style
+
+
+# Callback for 3D detail: zooming on the 2D map loads that region in full detail in the 3D map
+@callback(
+    Output('3D-Perlin-Map', 'figure', allow_duplicate=True),
+    Input('2D-Perlin-Map', 'relayoutData'),
+    State('toggle-3d', 'value'),
+    State('perlin-map-object', 'data'),
+
+    prevent_initial_call=True
+)
+def zoom_3d(relayout_data, toggle_value, perlin_map_data):
+    relayout_data = relayout_data or {}
+    if "show_3d" not in toggle_value:
+        return no_update
+    zoomed_map = stored_map(perlin_map_data)
+
+    # Double-click resets the axes: back to the whole map
+    if 'xaxis.range[0]' not in relayout_data or 'yaxis.range[0]' not in relayout_data:
+        return zoomed_map.display_3d()
+
+    # The 2D map shows columns along x and rows along y (reversed), one pixel per unit
+    size = len(zoomed_map.pmap)
+    xs = sorted([relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']])
+    ys = sorted([relayout_data['yaxis.range[0]'], relayout_data['yaxis.range[1]']])
+    j0, j1 = max(0, int(np.floor(xs[0]))), min(size, int(np.ceil(xs[1])) + 1)
+    i0, i1 = max(0, int(np.floor(ys[0]))), min(size, int(np.ceil(ys[1])) + 1)
+    if i1 - i0 < 2 or j1 - j0 < 2:
+        return zoomed_map.display_3d()
+    return zoomed_map.display_3d(window=(i0, i1, j0, j1))
 
 
 # Callback for Hidden Advanced Options
@@ -616,38 +793,33 @@ def toggle_advanced_options(toggle_value):
     return{'display': 'none'}
 
 
-@callback(
+@background_callback(
     Output('export-message', 'children'),
     Input('export-mesh-button', 'n_clicks'),
     State('perlin-map-object', 'data'),
 
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    progress=[Output('export-progress', 'value'), Output('export-status', 'children')],
+    cancel=[Input('cancel-button', 'n_clicks')],
 )
-def export_mesh(export_n_clicks, perlin_map_data):
+def export_mesh(set_progress, export_n_clicks, perlin_map_data):
     print(f"Perlin map data received: {perlin_map_data}")
     print(f"Export button clicked: {export_n_clicks}")
     if not perlin_map_data:
-        # TODO: fix this bug where on first generation it wont populate the perlin_map_data
         return "Error: No Perlin map data available for export."
 
     try:
-        new_perlin_map = PerlinMap(
-            size=perlin_map_data['size'],
-            seed1=perlin_map_data['seed1'],
-            seed2=perlin_map_data['seed2'],
-            oct1=perlin_map_data['oct1'],
-            oct2=perlin_map_data['oct2']
-        )
-
-        new_perlin_map.generate_perlin(
-            size=perlin_map_data['size'],
-            seed1=perlin_map_data['seed1'],
-            seed2=perlin_map_data['seed2'],
-            oct1=perlin_map_data['oct1'],
-            oct2=perlin_map_data['oct2']
-        )
-        new_perlin_map.exportmesh(len_side=60)
-        return "Mesh exported successfully!"
+        # Same map object as the one displayed, already generated
+        new_perlin_map = stored_map(perlin_map_data)
+
+        # The map is only generated if this exact export is not in the cache yet.
+        stages = list(export_stages)
+
+        def report(stage):
+            set_progress((str(stages.index(stage)), export_stages[stage]))
+        directory = new_perlin_map.exportmesh(len_side=60, cache=exportCache, progress=report)
+        set_progress((str(len(stages)), "Export ready."))
+        return f"Mesh exported successfully to {directory}"
     except KeyError as e:
         return f"Error: Missing data key - {str(e)}"
     except Exception as e:
@@ -672,5 +844,20 @@ def toggle_theme(theme):
         }
 
 
+def create_app():
+    # App factory: the callbacks above are registered with any app (the background ones with its
+    # job manager, see background_callback), and the layout is only
+    # built when a page is served, so creating the app is quick. Dash would otherwise call
+    # serve_layout once to check the callbacks: they are checked against the page without
+    # figures instead. With gunicorn, serve "dashAppPerlin:create_app().server".
+    manager = background_manager()
+    app = Dash(__name__, background_callback_manager=manager)  # Named here: Dash would inspect the call stack to find the name
+    register_background_callbacks(app, manager is not None)
+    app.validation_layout = page_layout()
+    app.layout = serve_layout
+    return app
+
+
 if __name__ == '__main__':
+    app = create_app()
     app.run(debug=True, use_reloader=False)  # MACOS = Needed to use use_reloader=False or else webpage wont load
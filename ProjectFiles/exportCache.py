@@ -0,0 +1,224 @@
+# Description: Content-addressed cache of exported maps. Each export is stored on disk in a
+# folder named after a hash of every parameter of the map and of the export, together with
+# the version of the code producing it, so a repeated export returns the existing files at once.
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+
+# Default disk budget of the export cache, in bytes.
+EXPORT_CACHE_BYTES = 2*2**30
+
+# Modules whose source makes the code version of an export: changing any of them
+# changes every key, so stale artifacts are never served.
+CODE_FILES = ("perlinMapGen.py", "meshExport.py", "noiseEngine.py")
+
+# File written last in a cache entry: entries without it are incomplete.
+MANIFEST = "manifest.json"
+
+# Age in seconds beyond which an unpublished build folder is considered left over by an
+# interrupted export, and removed.
+STALE_BUILD_SECONDS = 24*3600
+
+
+@lru_cache(maxsize = None)
+def codeVersion():
+    # Hash of the exporting modules, computed once per process.
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def exportKey(params):
+    """
+    This function will compute the cache key of an export.
+
+    Parameters
+    ----------
+    params : DICTIONARY
+        Every parameter the exported files depend on (JSON serializable).
+
+    Returns
+    -------
+    key : STRING
+        Hexadecimal hash of the parameters and of the code version.
+    """
+    text = json.dumps({"params": params, "code": codeVersion()}, sort_keys = True, default = str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+
+def folderBytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names)
+
+
+class ExportCache():
+
+    def __init__(self, directory, maxBytes = EXPORT_CACHE_BYTES):
+        """
+        Least recently used cache of exports on disk. Each entry is a folder named after its
+        key, holding the exported files and a manifest; the manifest's modification time
+        records the last use, and the oldest entries are removed beyond the disk budget.
+
+        Parameters
+        ----------
+        directory : STRING
+            Root folder of the cache (created if needed).
+        maxBytes : INTEGER, optional
+            Disk budget in bytes. The default value is EXPORT_CACHE_BYTES.
+
+        Returns
+        -------
+        None.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()  # Dash callbacks may run in several threads.
+
+    def __manifest(self, key):
+        return os.path.join(self.directory, key, MANIFEST)
+
+    def get(self, key):
+        # Path of the export of a complete entry, marked as used, or None.
+        with self.__lock:
+            manifest = self.__manifest(key)
+            if os.path.exists(manifest):
+                self.hits += 1
+                os.utime(manifest)
+                with open(manifest) as f:
+                    return os.path.join(os.path.dirname(manifest), json.load(f)["path"])
+            self.misses += 1
+            return None
+
+    def fetch(self, key, build, params = None):
+        """
+        Return the folder of the entry of the given key, building it first if needed.
+        Each build writes into its own folder inside the entry, without holding any lock, so
+        cached exports are served while others are built, even by other processes. The build
+        is then published by linking its manifest into place, which only the first build of
+        a key can do; the files never move, so paths written inside them stay valid.
+
+        Parameters
+        ----------
+        key : STRING
+            Key of the entry, see exportKey.
+        build : FUNCTION
+            Called with the folder of the entry to write the exported files into it,
+            returns the path of the export (a file or folder inside the entry).
+        params : DICTIONARY, optional
+            Parameters saved in the manifest for reference. The default value is None.
+
+        Returns
+        -------
+        path : STRING
+            Path of the export.
+        hit : BOOLEAN
+            Whether the entry already existed.
+        """
+        path = self.get(key)
+        if path is not None:
+            return path, True
+        entry = os.path.join(self.directory, key)
+        # Folder of this build, with a unique name.
+        os.makedirs(entry, exist_ok = True)
+        folder = tempfile.mkdtemp(prefix = f"{os.getpid()}-", dir = entry)
+        name = os.path.basename(folder)
+        start = time.perf_counter()
+        path = os.path.relpath(build(folder), entry)
+        manifest = {"key": key, "path": path, "params": params, "code": codeVersion(),
+                    "seconds": time.perf_counter() - start, "bytes": folderBytes(folder)}
+        temporary = os.path.join(entry, f"{name}.json")
+        with open(temporary, "w") as f:
+            json.dump(manifest, f, indent = 4, default = str)
+        try:
+            os.link(temporary, self.__manifest(key))
+        except FileExistsError:
+            # Another build of the same key was published first: its files are used instead.
+            shutil.rmtree(folder, ignore_errors = True)
+            with open(self.__manifest(key)) as f:
+                path = json.load(f)["path"]
+        finally:
+            os.remove(temporary)
+        with self.__lock:
+            self.__evict(keep = key)
+        return os.path.join(entry, path), False
+
+    def __removeStale(self):
+        # Remove the build folders of interrupted exports: folders of an entry that its
+        # manifest does not use, and entries without manifest, untouched for a long time.
+        if not os.path.isdir(self.directory):
+            return
+        limit = time.time() - STALE_BUILD_SECONDS
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            if not os.path.isdir(entry):
+                continue
+            used = None
+            if os.path.exists(self.__manifest(key)):
+                with open(self.__manifest(key)) as f:
+                    used = json.load(f)["path"].split(os.sep)[0]
+            # Other processes may be changing the entry meanwhile: missing or
+            # refilled folders are left alone.
+            try:
+                for name in os.listdir(entry):
+                    path = os.path.join(entry, name)
+                    if name not in (used, MANIFEST) and os.path.getmtime(path) < limit:
+                        if os.path.isdir(path):
+                            shutil.rmtree(path, ignore_errors = True)
+                        else:
+                            os.remove(path)
+                if used is None and not os.listdir(entry) and os.path.getmtime(entry) < limit:
+                    os.rmdir(entry)
+            except OSError:
+                pass
+
+    def __entries(self):
+        # (last use, bytes, key) of the complete entries, least recently used first.
+        entries = []
+        if os.path.isdir(self.directory):
+            for key in os.listdir(self.directory):
+                manifest = self.__manifest(key)
+                if os.path.exists(manifest):
+                    with open(manifest) as f:
+                        size = json.load(f)["bytes"]
+                    entries.append((os.path.getmtime(manifest), size, key))
+        return sorted(entries)
+
+    def __evict(self, keep = None):
+        self.__removeStale()
+        entries = self.__entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.maxBytes:
+                break
+            if key != keep:
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors = True)
+                total -= size
+
+    def clear(self):
+        with self.__lock:
+            shutil.rmtree(self.directory, ignore_errors = True)
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.__lock:
+            entries = self.__entries()
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries), "maxBytes": self.maxBytes}
+
+
+# Cache used by the Dash app, next to the folders of the direct exports.
+exportCache = ExportCache(os.path.join(os.getcwd(), "exports"))
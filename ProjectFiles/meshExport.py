@@ -0,0 +1,611 @@
+# Description: Mesh construction shared by every export code path (perlinMapGen.exportMesh,
+# gener_sdf.py and gener_obj.py). Vertices and faces of a heightmap grid are built as whole
+# arrays, with compact dtypes, without any Python-level work per cell. Mesh files
+# (GLB, STL, PLY, OBJ) and PNG images are streamed straight from these arrays.
+
+
+import json
+import struct
+import zlib
+import numpy as np
+
+
+def indexDtype(count):
+    # Smallest unsigned type able to index count vertices.
+    return np.uint32 if count < 2**32 else np.uint64
+
+
+def vertexDtype(size):
+    # float32 keeps grid coordinates exact to a few thousandths of a cell up to 65536 cells.
+    return np.float32 if size <= 2**16 else np.float64
+
+
+def gridVertices(heightmap):
+    """
+    This function will compute the vertices of a heightmap grid, one per pixel.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the pixels, of shape (rows, cols).
+
+    Returns
+    -------
+    vertices : NUMPY ARRAY
+        Array of shape (rows*cols, 3), with x along the columns and y along the rows.
+    """
+    heightmap = np.asarray(heightmap)
+    rows, cols = heightmap.shape
+    vertices = np.empty((rows, cols, 3), dtype = vertexDtype(max(rows, cols)))
+    vertices[..., 0] = np.linspace(0, cols, cols)[None, :]
+    vertices[..., 1] = np.linspace(0, rows, rows)[:, None]
+    vertices[..., 2] = heightmap
+    return vertices.reshape(-1, 3)
+
+
+def gridFaces(rows, cols):
+    """
+    This function will compute the triangles of a grid of rows x cols vertices,
+    two per cell, in the same order as the former loop over the cells.
+
+    Parameters
+    ----------
+    rows, cols : INTEGER
+        Number of vertices along both axes.
+
+    Returns
+    -------
+    faces : NUMPY ARRAY
+        Array of shape (2*(rows-1)*(cols-1), 3) of vertex indices.
+    """
+    idx = np.arange(rows*cols, dtype = indexDtype(rows*cols)).reshape(rows, cols)
+    idx1, idx2 = idx[:-1, :-1], idx[:-1, 1:]
+    idx3, idx4 = idx[1:, :-1], idx[1:, 1:]
+    faces = np.empty((rows - 1, cols - 1, 2, 3), dtype = idx.dtype)
+    faces[:, :, 0] = np.stack([idx1, idx2, idx3], axis = -1)
+    faces[:, :, 1] = np.stack([idx2, idx4, idx3], axis = -1)
+    return faces.reshape(-1, 3)
+
+
+def perimeter(rows, cols):
+    # Indices of the border vertices of a grid, counter-clockwise seen from above.
+    idx = np.arange(rows*cols).reshape(rows, cols)
+    return np.concatenate([idx[0, :-1], idx[:-1, -1], idx[-1, :0:-1], idx[:0:-1, 0]])
+
+
+def solidMesh(heightmap, base = 1.0):
+    """
+    This function will build a closed heightfield solid: the grid surface of the map,
+    vertical skirts along its border and a flat bottom cap, all wound outwards, so that
+    the mesh is watertight by construction and needs no repair.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the pixels, of shape (rows, cols).
+    base : FLOAT, optional
+        Thickness of the solid below the lowest pixel. The default value is 1.0.
+
+    Returns
+    -------
+    vertices : NUMPY ARRAY
+        Array of shape (rows*cols + 2*(rows+cols-2) + 1, 3): the grid vertices, then the
+        bottom of the border and the centre of the bottom cap.
+    faces : NUMPY ARRAY
+        Array of shape (2*(rows-1)*(cols-1) + 6*(rows+cols-2), 3) of vertex indices.
+    """
+    heightmap = np.asarray(heightmap)
+    rows, cols = heightmap.shape
+    top = gridVertices(heightmap)
+    border = perimeter(rows, cols)
+    count = len(top) + len(border) + 1
+    bottom = np.empty((len(border) + 1, 3), dtype = top.dtype)
+    bottom[:-1, :2] = top[border, :2]
+    bottom[-1, :2] = [cols/2, rows/2]
+    bottom[:, 2] = heightmap.min() - base
+    vertices = np.concatenate([top, bottom])
+    # Skirt quads (bottom k, bottom k+1, top k+1, top k) face outwards along a counter-clockwise border.
+    k = np.arange(len(border))
+    low = len(top) + k
+    nextLow = len(top) + (k + 1) % len(border)
+    quads = np.stack([low, nextLow, np.roll(border, -1), border], axis = 1)
+    skirts = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    # Bottom cap: a fan around its centre, facing down.
+    cap = np.stack([np.full(len(border), count - 1), nextLow, low], axis = 1)
+    faces = np.concatenate([gridFaces(rows, cols), skirts, cap]).astype(indexDtype(count))
+    return vertices, faces
+
+
+def rowRuns(values, change = None):
+    """
+    This function will find the runs of equal values along each row of a 2D array.
+
+    Parameters
+    ----------
+    values : NUMPY ARRAY
+        Array of shape (rows, cols).
+    change : NUMPY ARRAY, optional
+        Boolean array marking where a new run starts (the first column always starts one).
+        The default value is None (wherever the value changes).
+
+    Returns
+    -------
+    row, start, end : NUMPY ARRAY
+        Row of each run and its span of columns [start, end).
+    """
+    rows, cols = values.shape
+    if change is None:
+        change = values[:, 1:] != values[:, :-1]
+    starts = np.ones((rows, cols), dtype = bool)
+    starts[:, 1:] = change
+    row, start = np.nonzero(starts)
+    end = np.empty_like(start)
+    end[:-1] = start[1:]
+    end[np.r_[row[1:] != row[:-1], True]] = cols
+    return row, start, end
+
+
+def quadMesh(quads):
+    """
+    This function will turn quads, given as (n, 4, 3) arrays of corners in counter-clockwise
+    order around their outward normal, into a mesh with shared vertices.
+    """
+    corners = quads.reshape(-1, 3)
+    vertices, inverse = np.unique(corners, axis = 0, return_inverse = True)
+    inverse = inverse.reshape(-1, 4).astype(indexDtype(len(vertices)))
+    faces = np.concatenate([inverse[:, [0, 1, 2]], inverse[:, [0, 2, 3]]])
+    return vertices, faces
+
+
+def boundaryWalls(heights):
+    """
+    Walls between consecutive rows of cells whose heights differ, merged along the rows.
+    The outside of the map counts as height 0. Returns quads facing the lower cell,
+    in the plane y = boundary row.
+    """
+    rows, cols = heights.shape
+    padded = np.zeros((rows + 2, cols))
+    padded[1:-1] = heights
+    a, b = padded[:-1], padded[1:]
+    row, start, end = rowRuns(a, (a[:, 1:] != a[:, :-1]) | (b[:, 1:] != b[:, :-1]))
+    lo, hi = a[row, start], b[row, start]
+    keep = lo != hi
+    row, start, end, lo, hi = row[keep], start[keep], end[keep], lo[keep], hi[keep]
+    y = row.astype(float)
+    z0, z1 = np.minimum(lo, hi), np.maximum(lo, hi)
+    quads = np.stack([np.stack([start, y, z0], -1), np.stack([end, y, z0], -1),
+                      np.stack([end, y, z1], -1), np.stack([start, y, z1], -1)], axis = 1).astype(float)
+    # This order faces -y; walls whose higher cell has the lower row face +y.
+    flip = lo > hi
+    quads[flip] = quads[flip][:, ::-1]
+    return quads
+
+
+def flatRectangles(heights):
+    """
+    Rectangles of equal cells: the runs of each row, merged across consecutive rows when
+    they match. Returns their column span [x0, x1), row span [y0, y1) and value z.
+    """
+    row, start, end = rowRuns(heights)
+    value = heights[row, start]
+    order = np.lexsort((row, value, end, start))
+    row, start, end, value = row[order], start[order], end[order], value[order]
+    new = np.ones(len(row), dtype = bool)
+    new[1:] = (start[1:] != start[:-1]) | (end[1:] != end[:-1]) | (value[1:] != value[:-1]) | (row[1:] != row[:-1] + 1)
+    first = np.nonzero(new)[0]
+    last = np.r_[first[1:], len(row)] - 1
+    return start[first], end[first], row[first], row[last] + 1, value[first]
+
+
+def maxPool(heights, block):
+    # Coarsen a map to blocks of block x block cells, each one as high as its highest cell;
+    # the last row and column of blocks may be partial.
+    rows, cols = heights.shape
+    padded = np.pad(heights, ((0, -rows % block), (0, -cols % block)))
+    return padded.reshape(len(padded)//block, block, -1, block).max(axis = (1, 3))
+
+
+def lodGrid(heightmap, budget):
+    """
+    This function will reduce a heightmap to at most about budget vertices for display.
+    The map is coarsened with maxPool, so no obstacle disappears and its edges move by
+    less than a block, and each block is placed at its centre.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the cells, of shape (rows, cols).
+    budget : INTEGER
+        Target number of vertices.
+
+    Returns
+    -------
+    x, y : NUMPY ARRAY
+        Column and row coordinates of the blocks, in cells.
+    heights : NUMPY ARRAY
+        Heights of the blocks, of shape (len(y), len(x)).
+    """
+    heights = np.asarray(heightmap)
+    rows, cols = heights.shape
+    block = max(1, int(np.ceil(np.sqrt(rows*cols/budget))))
+    if block > 1:
+        heights = maxPool(heights, block)
+    centres = lambda n: np.minimum(np.arange(0, n, block) + (block - 1)/2, n - 1)
+    return centres(cols), centres(rows), heights
+
+
+def obstacleBoxes(heightmap, tolerance = 1):
+    """
+    This function will cover the obstacles of a piecewise flat heightmap with a few boxes,
+    for collision checking. The map is first coarsened to blocks of tolerance x tolerance
+    cells, each one as high as its highest cell, so boxes never miss an obstacle and
+    only grow by less than a block. Blocks are then merged like the flat tops of greedyMesh.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the cells, of shape (rows, cols). Cells of height 0 are free.
+    tolerance : INTEGER, optional
+        Side of the blocks in cells. The default value is 1 (exact cells).
+
+    Returns
+    -------
+    boxes : NUMPY ARRAY
+        Array of shape (n, 6): x0, y0, 0, x1, y1, height of each box, in cell units.
+    """
+    heights = np.asarray(heightmap, dtype = float)
+    rows, cols = heights.shape
+    block = max(1, int(tolerance))
+    coarse = maxPool(heights, block)
+    x0, x1, y0, y1, z = flatRectangles(coarse)
+    keep = z > 0
+    boxes = np.stack([x0, y0, np.zeros(len(x0)), x1, y1, z], axis = 1)[keep].astype(float)
+    boxes[:, [0, 1, 3, 4]] *= block
+    # Blocks of the last row and column are clipped to the map.
+    boxes[:, 3] = np.minimum(boxes[:, 3], cols)
+    boxes[:, 4] = np.minimum(boxes[:, 4], rows)
+    return boxes
+
+
+def greedyMesh(heightmap):
+    """
+    This function will mesh a piecewise flat heightmap (e.g. a binary obstacle map) with
+    one flat rectangle per run of equal cells, merged across consecutive rows when
+    the runs match, and vertical walls only where neighbouring cells differ. Each cell
+    (i, j) is the square [j, j+1] x [i, i+1], so the map spans the same [0, size] range
+    as the grid mesh, with far fewer triangles.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the cells, of shape (rows, cols).
+
+    Returns
+    -------
+    vertices : NUMPY ARRAY
+        Array of shape (n, 3), with x along the columns and y along the rows.
+    faces : NUMPY ARRAY
+        Array of shape (m, 3) of vertex indices, wound counter-clockwise seen from outside.
+    """
+    heights = np.asarray(heightmap, dtype = float)
+    rows, cols = heights.shape
+    x0, x1, y0, y1, z = flatRectangles(heights)
+    tops = np.stack([np.stack([x0, y0, z], -1), np.stack([x1, y0, z], -1),
+                     np.stack([x1, y1, z], -1), np.stack([x0, y1, z], -1)], axis = 1).astype(float)
+    # Walls across rows, then across columns (computed on the transposed map).
+    rowWalls = boundaryWalls(heights)
+    colWalls = boundaryWalls(heights.T)[:, :, [1, 0, 2]]
+    # Swapping x and y mirrors the quads, so their order is reversed to keep them outward.
+    colWalls = colWalls[:, ::-1]
+    vertices, faces = quadMesh(np.concatenate([tops, rowWalls, colWalls]))
+    return vertices.astype(vertexDtype(max(rows, cols))), faces
+
+
+def rtinMesh(heightmap, maxError = 0.5, keepBorder = False):
+    """
+    This function will mesh a heightmap adaptively with a right-triangulated irregular
+    network: starting from two triangles covering the map, a triangle is split at the
+    middle of its hypotenuse as long as the heights it covers may differ from its plane
+    by more than maxError. Errors are propagated to parent triangles, which bounds the
+    vertical error of every pixel and makes the mesh crack-free. Large flat or smooth areas end up with a few large triangles, while
+    curvature and obstacle edges keep fine ones. The map is padded (edges repeated) to a
+    2^n + 1 grid, and triangles crossing its real border are always split, so that only
+    triangles inside the map are kept. Every level of the triangle hierarchy is processed
+    as a whole array.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the pixels, of shape (rows, cols).
+    maxError : FLOAT, optional
+        Maximum vertical error, in height units. The default value is 0.5.
+    keepBorder : BOOLEAN, optional
+        Whether to keep every pixel of the border as a vertex, so that meshes of neighbouring
+        tiles share their edge vertices. The default value is False.
+
+    Returns
+    -------
+    vertices : NUMPY ARRAY
+        Array of shape (n, 3), spanning the same range as gridVertices.
+    faces : NUMPY ARRAY
+        Array of shape (m, 3) of vertex indices, wound counter-clockwise seen from above.
+    """
+    heights = np.asarray(heightmap, dtype = float)
+    rows, cols = heights.shape
+    span = 1 << int(np.ceil(np.log2(max(rows, cols, 2) - 1)))
+    n = span + 1
+    padded = np.pad(heights, ((0, n - rows), (0, n - cols)), mode = "edge").ravel()
+    lastX, lastY = cols - 1, rows - 1
+
+    def flat(p):
+        return p[:, 1]*n + p[:, 0]
+
+    def children(a, b, c, m):
+        # Left child (c, a, m) and right child (b, c, m).
+        return np.concatenate([c, b]), np.concatenate([a, c]), np.concatenate([m, m])
+
+    def crossesBorder(a, b, c):
+        x = np.stack([a[:, 0], b[:, 0], c[:, 0]])
+        y = np.stack([a[:, 1], b[:, 1], c[:, 1]])
+        return ((x.min(0) < lastX) & (x.max(0) > lastX)) | ((y.min(0) < lastY) & (y.max(0) > lastY))
+
+    def onBorder(a, b):
+        # Hypotenuses lying along the border of the map.
+        x = (a[:, 0] == b[:, 0]) & ((a[:, 0] == 0) | (a[:, 0] == lastX))
+        y = (a[:, 1] == b[:, 1]) & ((a[:, 1] == 0) | (a[:, 1] == lastY))
+        return x | y
+
+    roots = (np.array([[0, 0], [span, span]]), np.array([[span, span], [0, 0]]), np.array([[span, 0], [0, span]]))
+    # Top-down: middle index and interpolation error of every splittable triangle, by level.
+    levels = []
+    a, b, c = roots
+    while span > 1 and not ((b[0] - a[0]) % 2).any():
+        m = (a + b)//2
+        mid = flat(m)
+        error = np.abs((padded[flat(a)] + padded[flat(b)])/2 - padded[mid])
+        error[crossesBorder(a, b, c)] = np.inf
+        if keepBorder:
+            error[onBorder(a, b)] = np.inf
+        levels.append((mid, error))
+        a, b, c = children(a, b, c, m)
+    # Bottom-up: the plane of a child differs from its parent's by at most the middle error,
+    # so the parent error is bounded by the middle error plus the largest child error.
+    errors = np.zeros(n*n)
+    for depth in range(len(levels) - 1, -1, -1):
+        mid, error = levels[depth]
+        if depth + 1 < len(levels):
+            child = levels[depth + 1][0]
+            error = error + np.maximum(errors[child[:len(mid)]], errors[child[len(mid):]])
+        np.maximum.at(errors, mid, error)
+    # Extraction: split the triangles whose error is too large, level by level.
+    faces = []
+    a, b, c = roots
+    for depth in range(len(levels) + 1):
+        if depth < len(levels):
+            m = (a + b)//2
+            split = errors[flat(m)] > maxError
+        else:
+            split = np.zeros(len(a), dtype = bool)
+        keep = ~split
+        ka, kb, kc = a[keep], b[keep], c[keep]
+        inside = (np.maximum(np.maximum(ka, kb), kc) <= [lastX, lastY]).all(axis = 1)
+        faces.append(np.stack([flat(ka[inside]), flat(kc[inside]), flat(kb[inside])], axis = 1))
+        if not split.any():
+            break
+        a, b, c = children(a[split], b[split], c[split], m[split])
+    faces = np.concatenate(faces)
+    used, faces = np.unique(faces, return_inverse = True)
+    faces = faces.reshape(-1, 3).astype(indexDtype(len(used)))
+    y, x = np.divmod(used, n)
+    vertices = np.empty((len(used), 3), dtype = vertexDtype(max(rows, cols)))
+    vertices[:, 0] = x*cols/max(cols - 1, 1)
+    vertices[:, 1] = y*rows/max(rows - 1, 1)
+    vertices[:, 2] = padded[used]
+    return vertices, faces
+
+
+# Faces (or vertices) written per block by the streaming writers, which bounds their temporary memory.
+WRITE_BLOCK = 2**20
+
+
+def writeSTL(path, vertices, faces, block = WRITE_BLOCK):
+    """
+    This function will write a binary STL file, computing the facet normals block by block.
+
+    Parameters
+    ----------
+    path : STRING
+        Path of the written file.
+    vertices : NUMPY ARRAY
+        Array of shape (n, 3).
+    faces : NUMPY ARRAY
+        Array of shape (m, 3) of vertex indices.
+    block : INTEGER, optional
+        Number of triangles converted at once. The default value is WRITE_BLOCK.
+    """
+    record = np.dtype([("normal", "<f4", 3), ("corners", "<f4", (3, 3)), ("attribute", "<u2")])
+    with open(path, "wb") as f:
+        f.write(b"Binary STL".ljust(80, b" "))
+        f.write(struct.pack("<I", len(faces)))
+        for i in range(0, len(faces), block):
+            corners = vertices[faces[i:i + block]].astype(np.float64)
+            normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            lengths = np.linalg.norm(normals, axis = 1, keepdims = True)
+            data = np.zeros(len(corners), dtype = record)
+            data["normal"] = np.divide(normals, lengths, out = np.zeros_like(normals), where = lengths > 0)
+            data["corners"] = corners
+            data.tofile(f)
+
+
+def writePLY(path, vertices, faces, block = WRITE_BLOCK):
+    """
+    This function will write a binary little-endian PLY file (float32 vertices, uint32 indices).
+    Arguments are the same as writeSTL.
+    """
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              f"element vertex {len(vertices)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              f"element face {len(faces)}\n"
+              "property list uchar uint vertex_indices\nend_header\n")
+    record = np.dtype([("count", "u1"), ("indices", "<u4", 3)])
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        np.ascontiguousarray(vertices, dtype = "<f4").tofile(f)
+        for i in range(0, len(faces), block):
+            data = np.empty(len(faces[i:i + block]), dtype = record)
+            data["count"] = 3
+            data["indices"] = faces[i:i + block]
+            data.tofile(f)
+
+
+def writeGLB(path, vertices, faces, block = WRITE_BLOCK):
+    """
+    This function will write a binary glTF 2.0 file holding a single mesh: a JSON chunk
+    describing float32 positions and uint32 indices, followed by a binary chunk with both
+    buffers. Coordinates are written as they are (z up), like trimesh does.
+    Arguments are the same as writeSTL.
+    """
+    vertices = np.ascontiguousarray(vertices, dtype = "<f4")
+    positionBytes = vertices.nbytes
+    indexBytes = 12*len(faces)
+    layout = {
+        "asset": {"version": "2.0", "generator": "meshExport"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1, "mode": 4}]}],
+        "buffers": [{"byteLength": positionBytes + indexBytes}],
+        "bufferViews": [{"buffer": 0, "byteOffset": 0, "byteLength": positionBytes, "target": 34962},
+                        {"buffer": 0, "byteOffset": positionBytes, "byteLength": indexBytes, "target": 34963}],
+        "accessors": [{"bufferView": 0, "componentType": 5126, "count": len(vertices), "type": "VEC3",
+                       "min": vertices.min(axis = 0).tolist(), "max": vertices.max(axis = 0).tolist()},
+                      {"bufferView": 1, "componentType": 5125, "count": 3*len(faces), "type": "SCALAR"}],
+    }
+    text = json.dumps(layout, separators = (",", ":")).encode("ascii")
+    text += b" "*(-len(text) % 4)
+    # Both buffers are multiples of 4 bytes, so the binary chunk needs no padding.
+    total = 12 + 8 + len(text) + 8 + positionBytes + indexBytes
+    with open(path, "wb") as f:
+        f.write(np.array([0x46546C67, 2, total], dtype = "<u4").tobytes())
+        f.write(np.array([len(text), 0x4E4F534A], dtype = "<u4").tobytes())
+        f.write(text)
+        f.write(np.array([positionBytes + indexBytes, 0x004E4942], dtype = "<u4").tobytes())
+        vertices.tofile(f)
+        for i in range(0, len(faces), block):
+            np.ascontiguousarray(faces[i:i + block], dtype = "<u4").tofile(f)
+
+
+def writeOBJ(path, vertices, faces, block = WRITE_BLOCK):
+    """
+    This function will write a Wavefront OBJ file. Each block of lines is formatted by a
+    single string operation rather than one call per vertex or face.
+    Arguments are the same as writeSTL.
+    """
+    with open(path, "w") as f:
+        for i in range(0, len(vertices), block):
+            chunk = vertices[i:i + block]
+            f.write(("v %.6f %.6f %.6f\n"*len(chunk)) % tuple(chunk.ravel().tolist()))
+        for i in range(0, len(faces), block):
+            # OBJ indices start at 1.
+            chunk = faces[i:i + block].astype(np.int64) + 1
+            f.write(("f %d %d %d\n"*len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+# Native writers by file extension.
+meshWriters = {"glb": writeGLB, "stl": writeSTL, "ply": writePLY, "obj": writeOBJ}
+
+
+def resampleGrid(heightmap, side):
+    """
+    This function will resample a heightmap to side x side pixels by bilinear interpolation,
+    keeping its corners in place, one axis at a time.
+    """
+    heights = np.asarray(heightmap, dtype = float)
+    for axis in (0, 1):
+        n = heights.shape[axis]
+        position = np.linspace(0, n - 1, side)
+        i0 = np.minimum(position.astype(int), n - 2) if n > 1 else np.zeros(side, dtype = int)
+        w = position - i0
+        lo, hi = np.take(heights, i0, axis), np.take(heights, np.minimum(i0 + 1, n - 1), axis)
+        w = w[:, None] if axis == 0 else w[None, :]
+        heights = lo + w*(hi - lo)
+    return heights
+
+
+def heightmapImage(heightmap, side = None):
+    """
+    This function will encode a heightmap as a 16-bit Gazebo heightmap image, whose side
+    must be 2^n + 1 pixels. The map is resampled to that side (by default the smallest one
+    holding every pixel), scaled to the full 16-bit range, and flipped so that the first
+    row of the image is the far end of the y axis, as Gazebo reads it.
+
+    Parameters
+    ----------
+    heightmap : NUMPY ARRAY
+        Heights of the pixels, of shape (rows, cols), between 0 and 1.
+    side : INTEGER, optional
+        Side of the image, 2^n + 1. The default value is None (smallest side >= map side).
+
+    Returns
+    -------
+    image : NUMPY ARRAY
+        Array of shape (side, side) of dtype uint16.
+    """
+    heights = np.asarray(heightmap, dtype = float)
+    if side is None:
+        side = (1 << int(np.ceil(np.log2(max(max(heights.shape) - 1, 1))))) + 1
+    if side < 2 or (side - 1) & (side - 2):
+        raise ValueError(f"Heightmap side must be 2^n + 1, not {side}")
+    heights = resampleGrid(heights, side)
+    return np.rint(np.clip(heights[::-1], 0, 1)*65535).astype(np.uint16)
+
+
+def pngChunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encodePNG(image, level = 6):
+    """
+    This function will encode a grayscale PNG image, 1-bit, 8-bit or 16-bit depending on the
+    dtype of the image (bool, uint8 or uint16). Each row uses the "Up" filter (difference
+    with the row above), computed on the whole image at once, which lets zlib compress
+    smooth terrain well.
+
+    Parameters
+    ----------
+    image : NUMPY ARRAY
+        Array of shape (rows, cols) of dtype bool, uint8 or uint16.
+    level : INTEGER, optional
+        zlib compression level. The default value is 6.
+
+    Returns
+    -------
+    png : BYTES
+        Content of the PNG file.
+    """
+    rows, cols = image.shape
+    depths = {np.dtype(bool): 1, np.dtype(np.uint8): 8, np.dtype(np.uint16): 16}
+    if image.dtype not in depths:
+        raise ValueError(f"PNG images must be bool, uint8 or uint16, not {image.dtype}")
+    depth = depths[image.dtype]
+    if depth == 1:
+        # Rows of 8 pixels per byte, padded to whole bytes.
+        data = np.packbits(image, axis = 1)
+    else:
+        data = np.ascontiguousarray(image, dtype = ">u2" if depth == 16 else np.uint8).view(np.uint8).reshape(rows, -1)
+    raw = np.empty((rows, data.shape[1] + 1), dtype = np.uint8)
+    raw[:, 0] = 2
+    raw[0, 1:] = data[0]
+    np.subtract(data[1:], data[:-1], out = raw[1:, 1:])
+    header = struct.pack(">IIBBBBB", cols, rows, depth, 0, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + pngChunk(b"IHDR", header)
+            + pngChunk(b"IDAT", zlib.compress(raw.tobytes(), level)) + pngChunk(b"IEND", b""))
+
+
+def writePNG(path, image, level = 6):
+    """
+    This function will write a grayscale PNG file, see encodePNG.
+    """
+    png = encodePNG(image, level)
+    with open(path, "wb") as f:
+        f.write(png)
@@ -11,14 +11,21 @@
 
 
 
-from perlin_noise import PerlinNoise
-import matplotlib.pyplot as plt
+from noiseEngine import GradientNoise, noiseGrid, noiseGrids, coarseGrid, coarseFactors
 import random as rd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-import trimesh
 import os
+import json
+import base64
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from meshExport import gridVertices, gridFaces, greedyMesh, rtinMesh, solidMesh, obstacleBoxes, meshWriters
+from meshExport import heightmapImage, writePNG, encodePNG, lodGrid
+from exportCache import exportKey
+# matplotlib, plotly and trimesh are slow to import: they are imported by the functions using them,
+# so that importing this module (e.g. in each worker of the Dash app) stays fast.
 
 
 # This dictionary lists all possible options for choosing map density.
@@ -26,56 +33,66 @@ import os
 denstags = {"sparse":0.2, "medium":0.3, "dense":0.4}
 
 
-def normalize(rawMap):
-    maxima = [max(row) for row in rawMap]
-    minima = [min(row) for row in rawMap]
-    M, m = max(maxima), min(minima)
-    norMap = []
-    for row in rawMap:
-        norMap += [[(val-m)/(M-m) for val in row],]
-    return norMap
+# Array-native map helpers. They work on NumPy arrays end to end, and write into the optional
+# "out" buffer with in-place ufuncs (out may be the input itself), so a map pass allocates
+# at most one or two map-sized arrays. They give the same values as the element-wise formulas.
+
+def normalizeArray(rawMap, bounds = None, out = None):
+    # bounds = (min, max) lets a tile be normalized with the range of the whole world.
+    rawMap = np.asarray(rawMap, dtype = float)
+    m, M = (rawMap.min(), rawMap.max()) if bounds is None else bounds
+    out = np.subtract(rawMap, m, out = out)
+    return np.divide(out, M - m, out = out)
+
+
+def exponentiateArray(norMap, out = None):
+    out = np.multiply(norMap, 10, out = out)
+    np.subtract(out, 5, out = out)
+    np.tanh(out, out = out)
+    np.add(out, 1, out = out)
+    return np.divide(out, 2, out = out)
+
+
+def levelArray(norMap, dens, filt = None, out = None):
+    # Integer level of each pixel, int(val + dens) or int((val + dens)*fil).
+    out = np.add(norMap, dens, out = out)
+    if filt is not None:
+        np.multiply(out, filt, out = out)
+    return np.trunc(out, out = out)
+
+
+def binarizeArray(norMap, dens, filt = None, out = None):
+    return levelArray(norMap, dens, filt, out)
+
+
+def formalizeArray(norMap, dens, filt = None, out = None):
+    resize = 1/(3*(1-dens))  # Height difference of accessible surface equals to one third of total height.
+    # The accessible surface term is computed first, so that out may be norMap itself.
+    ground = np.multiply(norMap, resize)
+    out = levelArray(norMap, dens, filt, out)
+    ground *= 1 - out
+    return np.add(out, ground, out = out)
+
+
+# List-based helpers, kept as thin wrappers around the array-native ones.
+
+def normalize(rawMap, bounds = None):
+    return normalizeArray(rawMap, bounds).tolist()
 
 
 def exponentiate(norMap):
-    expMap = []
-    for row in norMap:
-        expMap += [[(1+np.tanh(10*val-5))/2 for val in row],]
-    return expMap
+    return exponentiateArray(norMap).tolist()
 
 
 def binarize(norMap, dens, filt = None):
-    binMap = []
-    if filt == None:
-        for row in norMap:
-            binMap += [[int(val + dens) for val in row],]
-    else:
-        for i in range(len(norMap)):
-            row = []
-            for j in range(len(norMap[i])):
-                val, fil = norMap[i][j], filt[i][j]
-                row += [int((val + dens)*fil),]
-            binMap += [row,]        
-    return binMap
+    return binarizeArray(norMap, dens, filt).astype(int).tolist()
 
 
 def formalize(norMap, dens, filt = None):
-    forMap = []
-    resize = 1/(3*(1-dens))  # Height difference of accessible surface equals to one third of total height.
-    if filt == None:
-        for row in norMap:
-            forMap += [[int(val + dens) + resize*(1 - int(val + dens))*val for val in row],]
-    else:
-        for i in range(len(norMap)):
-            row = []
-            for j in range(len(norMap[i])):
-                val, fil = norMap[i][j], filt[i][j]
-                level = (val + dens)*fil
-                row += [int(level) + resize*(1 - int(level))*val,]
-            forMap += [row,] 
-    return forMap
+    return formalizeArray(norMap, dens, filt).tolist()
 
 
-def generPerlin(userSeed1 = None, userSeed2 = None, userOct1 = 20, userOct2 = 20, size = 600):
+def generPerlin(userSeed1 = None, userSeed2 = None, userOct1 = 20, userOct2 = 20, size = 600, backend = "numpy", workers = 1):
     """
     This function will generate a large perlin noise as a square map from a given size.
     To avoid any spatial repetition in larger maps, two perlin noise generated with 
@@ -85,10 +102,16 @@ def generPerlin(userSeed1 = None, userSeed2 = None, userOct1 = 20, userOct2 = 20
     ----------
     size : INTEGER, optional
         Size of the square map in pixels. The default value is 600.
+    backend : STRING, optional
+        Noise backend, "numpy" (batched) or "perlin_noise" (reference, per pixel).
+        Both agree within noiseEngine.TOLERANCE. The default value is "numpy".
+    workers : INTEGER, optional
+        Number of processes sharing the rows of both noise layers ("numpy" backend).
+        The result is identical to the serial one. The default value is 1.
 
     Returns
     -------
-    perlin : LIST
+    perlin : NUMPY ARRAY
         2D List of values of each pixel.
     seed : STRING
         Combined seed written from the seeds of the two superposed perlin noise,
@@ -102,17 +125,88 @@ def generPerlin(userSeed1 = None, userSeed2 = None, userOct1 = 20, userOct2 = 20
 
    # s1 = rd.randint(1, 1000)
    # s2 = rd.randint(1001, 2000) # We ensure there is no chance for the seeds to be the same.
-    noise1 = PerlinNoise(octaves = userOct1, seed = userSeed1)
-    noise2 = PerlinNoise(octaves = userOct2, seed = userSeed2)
-    subpic = [[noise1([i/size, j/size]) for j in range(size)] for i in range(size)]
-    suppic = [[noise2([i/size, j/size]) for j in range(size)] for i in range(size)]
-    perlin = [[subpic[i][j]+suppic[j][i] for j in range(size)] for i in range(size)]
+    subpic, suppic = noiseGrids([(userSeed1, userOct1), (userSeed2, userOct2)], size, backend, workers)
+    perlin = subpic + suppic.T
     seed = f"{userSeed1}t{userSeed2}"
     print(f"Perlin noise of size {size} generated with seed {seed}.")
-    return np.array(perlin), seed
+    return perlin, seed
+
+
+def densityFilter(size, filterSeed = None, backend = "numpy", workers = 1, filterRes = None):
+    """
+    This function will generate the exponentiated density filter used for spatial disparities.
+
+    Parameters
+    ----------
+    size : INTEGER
+        Size of the square map in pixels.
+    filterSeed : INTEGER, optional
+        Seed of the density filter. The default value is None (random).
+    backend : STRING, optional
+        Noise backend. The default value is "numpy".
+    workers : INTEGER, optional
+        Number of processes. The default value is 1.
+    filterRes : INTEGER, optional
+        Side of a coarse grid on which the filter is evaluated before being upsampled
+        to the map size (noiseEngine.coarseGrid), e.g. 64. The normalized filter then differs
+        from the full resolution one by less than noiseEngine.COARSE_TOLERANCE.
+        The default value is None (full resolution).
+
+    Returns
+    -------
+    efil : NUMPY ARRAY
+        Filter values between 0 and 1.
+    fseed : STRING
+        Seed of the filter, with special formatting "f2222".
+    """
+    s = rd.randint(2001,3000) if filterSeed is None else filterSeed
+    if filterRes:
+        filt = coarseGrid(s, 2, size, filterRes)
+    else:
+        filt = noiseGrid(s, 2, size, backend, workers)
+    fseed = f"f{s}"
+    print(f"Density filter map generated with seed {fseed}.")
+    # The cached noise layer is read-only: it is normalized into a new buffer,
+    # which is then exponentiated in place.
+    efil = normalizeArray(filt)
+    return exponentiateArray(efil, out = efil), fseed
+
+
+def thresholdMap(nper, density = "medium", topography = False, efil = None, out = None):
+    """
+    This function will turn a normalized perlin noise into a binary or topographic map.
+
+    Parameters
+    ----------
+    nper : NUMPY ARRAY
+        Normalized values of each pixel.
+    density : STRING (Default) or FLOAT, optional
+        Density option label (low = "sparse", "medium", high = "dense").
+        The default option is "medium".
+    topography : BOOLEAN, optional
+        Boolean indicating whether the output should include uneven ground.
+        The default value is False (binary map).
+    efil : NUMPY ARRAY, optional
+        Density filter returned by densityFilter. The default value is None (no disparity).
+    out : NUMPY ARRAY, optional
+        Buffer receiving the map, which may be nper itself. The default value is None (new array).
+
+    Returns
+    -------
+    pmap : NUMPY ARRAY
+        Values of each pixel after conversion and scaling between 0 and 1.
+    """
+    dens = denstags[density] if density in denstags else density
+    if topography:
+        pmap = formalizeArray(nper, dens, efil, out)
+        print(f"Topographic map generated from perlin noise with density set on: {density}.")
+    else:
+        pmap = binarizeArray(nper, dens, efil, out)
+        print(f"Binary map generated from perlin noise with density set on: {density}.")
+    return pmap
 
 
-def perlin2map(perlin, density = "medium", topography = False, disparity = False):
+def perlin2map(perlin, density = "medium", topography = False, disparity = False, backend = "numpy", workers = 1, filterSeed = None, filterRes = None):
     """
     This function will convert a given perlin noise into a 2D map,
     taking into account density (more or fewer obstacles), topography (presence or not of irregular ground)
@@ -120,8 +214,8 @@ def perlin2map(perlin, density = "medium", topography = False, disparity = False
 
     Parameters
     ----------
-    perlin : LIST
-        2D List of values of each pixel.
+    perlin : NUMPY ARRAY or LIST
+        2D array of values of each pixel.
     density : STRING (Default) or FLOAT, optional
         Density option label (low = "sparse", "medium", high = "dense").
         The default option is "medium".
@@ -131,36 +225,219 @@ def perlin2map(perlin, density = "medium", topography = False, disparity = False
     disparity : BOOLEAN, optional
         Boolean indicating whether the outputted map should feature spatial disparities.
         The default value is False (homogeneous distribution of motives).
+    backend : STRING, optional
+        Noise backend used for the density filter. The default value is "numpy".
+    workers : INTEGER, optional
+        Number of processes used for the density filter. The default value is 1.
+    filterSeed : INTEGER, optional
+        Seed of the density filter, so that a cached filter can be reused.
+        The default value is None (random).
+    filterRes : INTEGER, optional
+        Side of the coarse grid of the density filter (see densityFilter).
+        The default value is None (full resolution).
     
     Returns
     -------
-    pmap : LIST
-        2D List of values of each pixel after conversion and scaling between 0 and 1.
+    pmap : NUMPY ARRAY
+        Values of each pixel after conversion and scaling between 0 and 1.
     """
-    dens = denstags[density] if density in denstags else density
-    nper = normalize(perlin)
+    nper = normalizeArray(perlin)
     fseed = None
     efil = None
     if disparity:
-        size = len(perlin)
-        s = rd.randint(2001,3000)
-        noise = PerlinNoise(octaves = 2, seed = s)
-        filt = [[noise([i/size, j/size]) for j in range(size)] for i in range(size)]
-        fseed = f"f{s}"
-        print(f"Density filter map generated with seed {fseed}.")
-        nfil = normalize(filt)
-        efil = exponentiate(nfil)
-    if topography:
-        pmap = formalize(nper, dens, efil)
-        print(f"Topographic map generated from perlin noise with density set on: {density}.")
-    else:
-        pmap = binarize(nper, dens, efil)
-        print(f"Binary map generated from perlin noise with density set on: {density}.")
+        efil, fseed = densityFilter(len(perlin), filterSeed, backend, workers, filterRes)
+    # The map is written over the normalized noise, which is not needed afterwards.
+    pmap = thresholdMap(nper, density, topography, efil, out = nper)
     return pmap, fseed
 
 
-def disp2Dmap(pmap, seed):
-    fig = px.imshow(pmap, color_continuous_scale='gray')
+def generMap(userSeed1 = None, userSeed2 = None, userOct1 = 20, userOct2 = 20, size = 600, density = "medium",
+             topography = False, disparity = False, filterSeed = None, filterRes = None, blockRows = 256):
+    """
+    This function will generate the final map straight from its parameters, fusing
+    superposition, normalization, density filtering and thresholding. A first pass writes
+    the raw noise into the output array block by block and reduces its extrema, a second
+    pass normalizes and thresholds each block in place. Only the output array is map-sized,
+    instead of the eight intermediate maps of generPerlin and perlin2map, and the result is
+    the same as perlin2map(generPerlin(...)) with the "numpy" backend.
+    The noise layers are not stored in the layer cache.
+
+    Parameters
+    ----------
+    userSeed1, userSeed2 : INTEGER, optional
+        Seeds used to generate Perlin noises. Default value is None (random).
+    userOct1, userOct2 : INTEGER, optional
+        Number of octaves (level of details) used to generate Perlin noises. Default value is 20.
+    size : INTEGER, optional
+        Size of the square map in pixels. The default value is 600.
+    density : STRING (Default) or FLOAT, optional
+        Density option label (low = "sparse", "medium", high = "dense").
+        The default option is "medium".
+    topography : BOOLEAN, optional
+        Boolean indicating whether the output should include uneven ground.
+        The default value is False (binary map).
+    disparity : BOOLEAN, optional
+        Boolean indicating whether the outputted map should feature spatial disparities.
+        The default value is False (homogeneous distribution of motives).
+    filterSeed : INTEGER, optional
+        Seed of the density filter. The default value is None (random).
+    filterRes : INTEGER, optional
+        Side of the coarse grid of the density filter (see densityFilter).
+        The default value is None (full resolution).
+    blockRows : INTEGER, optional
+        Number of rows processed at once. The default value is 256.
+
+    Returns
+    -------
+    pmap : NUMPY ARRAY
+        Values of each pixel after conversion and scaling between 0 and 1.
+    seed : STRING
+        Combined seed with special formatting "000t1111".
+    fseed : STRING
+        Seed of the density filter with special formatting "f2222", or None.
+    """
+    if userSeed1 is None:
+        userSeed1 = rd.randint(1,1000)
+    if userSeed2 is None:
+        userSeed2 = rd.randint(1001, 2000)
+    dens = denstags[density] if density in denstags else density
+    noise1 = GradientNoise(octaves = userOct1, seed = userSeed1)
+    noise2 = GradientNoise(octaves = userOct2, seed = userSeed2)
+    coords = np.arange(size)/size
+    blocks = [(i0, min(i0 + blockRows, size)) for i0 in range(0, size, blockRows)]
+    fseed = None
+    if disparity:
+        s = rd.randint(2001,3000) if filterSeed is None else filterSeed
+        fseed = f"f{s}"
+        if filterRes:
+            left, right = coarseFactors(s, 2, size, filterRes)
+        else:
+            fnoise = GradientNoise(octaves = 2, seed = s)
+
+    def filterBlock(i0, i1):
+        # Filter rows are cheap to recompute, so the filter is never stored whole.
+        if filterRes:
+            return left[i0:i1] @ right
+        return fnoise.sample(coords[i0:i1, None], coords[None, :])
+
+    pmap = np.empty((size, size))
+    m, M = np.inf, -np.inf
+    fm, fM = np.inf, -np.inf
+    # First pass: raw noise (second layer transposed) and extrema.
+    for i0, i1 in blocks:
+        rows = coords[i0:i1]
+        block = pmap[i0:i1]
+        np.add(noise1.sample(rows[:, None], coords[None, :]), noise2.sample(coords[:, None], rows[None, :]).T, out = block)
+        m, M = min(m, block.min()), max(M, block.max())
+        if disparity:
+            fil = filterBlock(i0, i1)
+            fm, fM = min(fm, fil.min()), max(fM, fil.max())
+    # Second pass: normalization, filtering and thresholding in place.
+    for i0, i1 in blocks:
+        block = pmap[i0:i1]
+        normalizeArray(block, (m, M), out = block)
+        efil = None
+        if disparity:
+            efil = normalizeArray(filterBlock(i0, i1), (fm, fM))
+            exponentiateArray(efil, out = efil)
+        if topography:
+            formalizeArray(block, dens, efil, out = block)
+        else:
+            binarizeArray(block, dens, efil, out = block)
+    seed = f"{userSeed1}t{userSeed2}"
+    kind = "Topographic" if topography else "Binary"
+    print(f"{kind} map of size {size} generated with seed {seed}{fseed or ''} and density set on: {density}.")
+    return pmap, seed, fseed
+
+
+# Side of the blocks of the preview map: one pixel out of PREVIEW_STEP along each axis.
+PREVIEW_STEP = 8
+
+
+def previewMap(size, seed1, seed2, oct1 = 20, oct2 = 20, density = "medium", topography = False, filterSeed = None, step = PREVIEW_STEP):
+    """
+    This function will generate a coarse preview of a map, from one pixel out of step along
+    each axis. The noise is evaluated at the world coordinates of these pixels, so the preview
+    samples the same noise as the full map (pixel (k, l) of the preview is pixel
+    (k*step, l*step) of the map); only its normalization range is estimated from the samples.
+
+    Parameters
+    ----------
+    size : INTEGER
+        Size of the full square map in pixels.
+    seed1, seed2 : INTEGER
+        Seeds of the two superposed perlin noises.
+    oct1, oct2 : INTEGER, optional
+        Number of octaves of the perlin noises. Default value is 20.
+    density : STRING (Default) or FLOAT, optional
+        Density option label (low = "sparse", "medium", high = "dense").
+        The default option is "medium".
+    topography : BOOLEAN, optional
+        Boolean indicating whether the output should include uneven ground.
+        The default value is False (binary map).
+    filterSeed : INTEGER, optional
+        Seed of the density filter. The default value is None (no disparity).
+    step : INTEGER, optional
+        Pixels of the full map per pixel of the preview. The default value is PREVIEW_STEP.
+
+    Returns
+    -------
+    preview : NUMPY ARRAY
+        Map of shape (ceil(size/step), ceil(size/step)).
+    """
+    coords = np.arange(0, size, step)/size
+    subpic = GradientNoise(octaves = oct1, seed = seed1).sample(coords[:, None], coords[None, :])
+    # The second noise is transposed, as in generPerlin.
+    suppic = GradientNoise(octaves = oct2, seed = seed2).sample(coords[:, None], coords[None, :])
+    efil = None
+    if filterSeed is not None:
+        efil = normalizeArray(GradientNoise(octaves = 2, seed = filterSeed).sample(coords[:, None], coords[None, :]))
+        exponentiateArray(efil, out = efil)
+    return thresholdMap(normalizeArray(subpic + suppic.T), density, topography, efil)
+
+
+def grayImage(values):
+    # Quantize values to a grayscale image, from black (minimum) to white (maximum):
+    # 1 bit per pixel for binary maps, 8 bits otherwise.
+    values = np.asarray(values)
+    if np.isin(values, (0, 1)).all():
+        return values.astype(bool)
+    low, high = values.min(), values.max()
+    scale = 255/(high - low) if high > low else 0
+    return np.round((values - low)*scale).astype(np.uint8)
+
+
+def imageFigure(values, step = 1):
+    # Figure showing values as a PNG image layer instead of a heatmap of every cell,
+    # with the axes and hover coordinates of px.imshow. Each value spans step pixels of the map.
+    import plotly.graph_objects as go
+    png = base64.b64encode(encodePNG(grayImage(values))).decode("ascii")
+    fig = go.Figure(go.Image(source = f"data:image/png;base64,{png}", dx = step, dy = step,
+                             hovertemplate = "x: %{x}<br>y: %{y}<extra></extra>"))
+    fig.update_layout(
+        xaxis = dict(constrain = 'domain', scaleanchor = 'y'),
+        yaxis = dict(autorange = 'reversed', constrain = 'domain')
+    )
+    return fig
+
+
+def dispPerlin(perlin):
+    fig = imageFigure(perlin)
+    fig.update_layout(
+        title={
+            'text': "Perlin Noise",
+            'y': 0.95,
+            'x': 0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        },
+        coloraxis_showscale=False  # Hide color scale
+    )
+    return fig
+
+
+def disp2Dmap(pmap, seed, step = 1):
+    fig = imageFigure(pmap, step)
     fig.update_layout(
         title={
             'text': f"Map generated from Perlin noise with seed {seed}.",
@@ -174,22 +451,39 @@ def disp2Dmap(pmap, seed):
     return fig
 
 
-def disp3Dmap(pmap, seed, height = 20):
-    Z = np.array(pmap)*height
-    fig = go.Figure(data = [go.Surface(z = Z, colorscale = 'Viridis')])
+# Vertex budget of the 3D figure: about 64 kB of heights, whatever the map size.
+LOD_VERTICES = 128*128
+
+
+def disp3Dmap(pmap, seed, height = 20, budget = LOD_VERTICES, window = None):
+    # The surface is reduced to the vertex budget (see meshExport.lodGrid) and sent as float32
+    # arrays, which plotly encodes in binary. A window (i0, i1, j0, j1) of rows and columns
+    # shows that region only, in full detail when it fits the budget.
+    import plotly.graph_objects as go
+    i0, i1, j0, j1 = (0, len(pmap), 0, len(pmap[0])) if window is None else window
+    x, y, Z = lodGrid(np.asarray(pmap)[i0:i1, j0:j1], budget)
+    fig = go.Figure(data = [go.Surface(x = (x + j0).astype(np.float32), y = (y + i0).astype(np.float32),
+                                       z = (Z*height).astype(np.float32), colorscale = 'Viridis')])
     fig.update_layout(
         title = f"3D map generated from Perlin noise with seed {seed}.",
         scene = dict(
             aspectmode = "cube",
             xaxis = dict(visible = False),
             yaxis = dict(visible = False),
-            zaxis = dict(range = [0, len(pmap)], visible = False)
+            zaxis = dict(range = [0, max(i1 - i0, j1 - j0)], visible = False)
         )
     )
     return fig
 
 
-def WriteSDF(directory, object_name, model_path, length = 60, height = 2):
+def sdfScale(length, height, side, top):
+    # Scale factors (x, y, z) from a mesh spanning side x side x top to meters. A flat mesh
+    # keeps the horizontal factor.
+    sx = length/side
+    return sx, sx, height/top if top else sx
+
+
+def WriteSDF(directory, object_name, model_path, length = 60, height = 2, *, extent = None, collision_path = None, collision_boxes = None):
     """
     This function is meant to write a basic SDF file for a given object.
 
@@ -200,17 +494,53 @@ def WriteSDF(directory, object_name, model_path, length = 60, height = 2):
     object_name : STRING
         Name used to save the exported object.
     model_path : STRING
-        Path to find the STL file of the exported object.
+        Path to find the mesh file of the exported object (DAE, GLB, STL or PLY).
     length : INTEGER, optional
         Side length in meters. The default value is 60.
     height : INTEGER, optional
         Map height in meters. The default value is 2.
+    extent : TUPLE, optional
+        Side and height (side, top) of the mesh in its own units, scaled to length and height
+        with a <scale> on the visual and collision meshes. The default value is None
+        (read from the bounds of the mesh file).
+    collision_path : STRING, optional
+        Path to a simplified mesh used for collisions. The default value is None (model_path).
+    collision_boxes : NUMPY ARRAY, optional
+        Boxes (x0, y0, z0, x1, y1, z1) in meters (already scaled) used for collisions instead
+        of any mesh, see meshExport.obstacleBoxes. The default value is None.
 
     Returns
     -------
     None.
 
     """
+    if extent is None:
+        import trimesh
+        bounds = trimesh.load(model_path, force = "mesh").bounds
+        extent = (bounds[1, 0] - bounds[0, 0], bounds[1, 2])
+    sx, sy, sz = sdfScale(length, height, *extent)
+    if collision_boxes is not None:
+        collision = ""
+        for k, (x0, y0, z0, x1, y1, z1) in enumerate(collision_boxes):
+            collision += f"""
+                    <collision name="box{k}">
+                        <pose>{(x0 + x1)/2} {(y0 + y1)/2} {(z0 + z1)/2} 0 0 0</pose>
+                        <geometry>
+                            <box>
+                                <size>{x1 - x0} {y1 - y0} {z1 - z0}</size>
+                            </box>
+                        </geometry>
+                    </collision>"""
+    else:
+        collision = f"""
+                    <collision name="collision">
+                        <geometry>
+                            <mesh>
+                                <uri>{model_path if collision_path is None else collision_path}</uri>
+                                <scale>{sx} {sy} {sz}</scale>
+                            </mesh>
+                        </geometry>
+                    </collision>"""
 
     sdf_model_file_text = \
     f"""<?xml version='1.0'?>
@@ -222,18 +552,10 @@ def WriteSDF(directory, object_name, model_path, length = 60, height = 2):
                         <geometry>
                             <mesh>
                                 <uri>{model_path}</uri>
-                                <size>{length} {length} {height}</size>
-                            </mesh>
-                        </geometry>
-                    </visual>
-                    <collision name="collision">
-                        <geometry>
-                            <mesh>
-                                <uri>{model_path}</uri>
-                                <size>{length} {length} {height}</size>
+                                <scale>{sx} {sy} {sz}</scale>
                             </mesh>
                         </geometry>
-                    </collision>
+                    </visual>{collision}
                 </link>
             </model>
         </sdf>"""
@@ -243,10 +565,103 @@ def WriteSDF(directory, object_name, model_path, length = 60, height = 2):
         f.write(sdf_model_file_text)
 
 
-def exportMesh(pmap, seed, len_side = 60, zrat = 2/60):
+# Available meshing modes. "grid" makes two triangles per pixel, "greedy" merges flat
+# runs of cells into rectangles with walls only along obstacle edges (binary maps),
+# "adaptive" keeps only the triangles needed to stay within a vertical error (topography),
+# "solid" closes the grid with skirts and a bottom cap instead of repairing it.
+meshModes = ("grid", "greedy", "adaptive", "solid")
+# Exported file types: COLLADA through trimesh, the others with the streaming writers of meshExport.
+meshFormats = ("dae",) + tuple(meshWriters)
+# Simplified collision geometries: an adaptive mesh within a vertical tolerance, or boxes
+# covering the obstacles of a binary map in blocks of tolerance pixels.
+collisionModes = ("decimated", "boxes")
+# Files exportMesh can write: the mesh formats, the SDF file, a PNG preview and the raw map.
+exportFormats = meshFormats + ("sdf", "png", "npy")
+
+
+def writeMeshFile(path, fileType, vertices, faces, mesh = None):
+    # Stream binary formats from the arrays, export the others through trimesh.
+    if fileType in meshWriters:
+        meshWriters[fileType](path, vertices, faces)
+    else:
+        import trimesh
+        if mesh is None:
+            mesh = trimesh.Trimesh(vertices = vertices, faces = faces, process = False)
+        trimesh.exchange.export.export_mesh(
+            mesh = mesh,
+            file_obj = path,
+            file_type = fileType)
+
+
+def meshArrays(pmap, height, mode, maxError = 0.5, keepBorder = False):
+    """
+    Vertices and faces of the meshing modes built by construction (every mode but "grid"),
+    without any trimesh object. Arguments are the same as buildMesh; keepBorder keeps every
+    border pixel of the "adaptive" mesh (see meshExport.rtinMesh).
+    """
+    heightmap = np.asarray(pmap) * height
+    if mode == "greedy":
+        return greedyMesh(heightmap)
+    if mode == "adaptive":
+        return rtinMesh(heightmap, maxError, keepBorder)
+    if mode == "solid":
+        return solidMesh(heightmap)
+    raise ValueError(f"Unknown mesh mode: {mode}")
+
+
+def buildMesh(pmap, height, mode = "grid", maxError = 0.5):
     """
-    This function will export the given map as a 3D object (COLLADA file), with a meaningful name inherited
-    from the construction parameters. It will also write a SDF file.
+    This function will build the triangle mesh of a map.
+
+    Parameters
+    ----------
+    pmap : LIST
+        2D List of values of each pixel after conversion and scaling between 0 and 1.
+    height : INTEGER
+        Height of the map in pixel units.
+    mode : STRING, optional
+        One of meshModes. The "grid" mesh goes through the trimesh repair pipeline, the
+        "greedy" (meshExport.greedyMesh), "adaptive" (meshExport.rtinMesh) and "solid"
+        (meshExport.solidMesh, watertight) ones are consistently wound by construction and
+        need no repair. The default value is "grid".
+    maxError : FLOAT, optional
+        Maximum vertical error of the "adaptive" mesh, in pixel units. The default value is 0.5.
+
+    Returns
+    -------
+    mesh : TRIMESH
+        Mesh of the map.
+    """
+    import trimesh
+    if mode != "grid":
+        vertices, faces = meshArrays(pmap, height, mode, maxError)
+        return trimesh.Trimesh(vertices = vertices, faces = faces, process = False)
+    heightmap = np.asarray(pmap) * height
+    vertices = gridVertices(heightmap)
+    # Generate the faces of the grid.
+    faces = gridFaces(*heightmap.shape)
+    mesh = trimesh.Trimesh(vertices = vertices, faces = faces)
+    print("\nApplying scale factor...")
+    mesh.apply_scale(scaling = 1.0)
+    print("Merging vertices closer than a pre-set constant...")
+    mesh.merge_vertices()
+    print("Removing duplicate faces...")
+    mesh.update_faces(mesh.unique_faces())
+    print("Making the mesh watertight...")
+    trimesh.repair.fill_holes(mesh)
+    trimesh.repair.fix_normals(mesh)
+    return mesh
+
+
+def exportMesh(pmap, seed, len_side = 60, zrat = 2/60, mesh = None, mode = "grid", maxError = 0.5, stats = False, fileType = "dae",
+               collision = None, tolerance = 2, outdir = None, formats = None, progress = None):
+    """
+    This function will export the given map as a 3D object (COLLADA file by default), with a meaningful name
+    inherited from the construction parameters. It will also write a SDF file referencing it.
+    Binary formats are streamed from the vertex and face arrays by meshExport, without building a trimesh
+    object unless the mode needs one ("grid") or statistics are asked for.
+    Several formats can be written at once: the mesh is built once, and every file is written by its
+    own thread from it, so the whole bundle takes about as long as its slowest file.
 
     Parameters
     ----------
@@ -259,90 +674,403 @@ def exportMesh(pmap, seed, len_side = 60, zrat = 2/60):
         Side length in meters. The default value is 60.
     zrat : FLOAT, optional
         Ratio between height and side length. The default value is 2/60.
+    mesh : TRIMESH, optional
+        Mesh already built by buildMesh for this map. The default value is None (built here).
+    mode : STRING, optional
+        Meshing mode used when the mesh is built here, one of meshModes.
+        The default value is "grid".
+    maxError : FLOAT, optional
+        Maximum vertical error of the "adaptive" mode. The default value is 0.5.
+    stats : BOOLEAN, optional
+        Whether to print the volume, convex hull volume and bounding box volume of the mesh.
+        They are only diagnostics and slow on large maps. The default value is False.
+    fileType : STRING, optional
+        Mesh file type, one of meshFormats. The binary "glb", "stl" and "ply" files are much
+        smaller and faster to write and load than COLLADA. The default value is "dae".
+    collision : STRING, optional
+        Simplified collision geometry written next to the visual mesh, one of collisionModes:
+        "decimated" writes an adaptive mesh, "boxes" puts box primitives in the SDF file.
+        The default value is None (the visual mesh is used for collisions).
+    tolerance : FLOAT, optional
+        Coarseness of the collision geometry: maximum vertical error in pixel units for
+        "decimated", side of the blocks in pixels for "boxes". The default value is 2.
+    outdir : STRING, optional
+        Folder in which the export folder is created. The default value is None (current folder).
+    formats : LIST, optional
+        Files to write, among exportFormats: mesh formats, "sdf" (referencing the first mesh
+        format of the list), "png" (8-bit preview of the map) and "npy" (raw map).
+        The default value is None ([fileType, "sdf"]).
+    progress : FUNCTION, optional
+        Called with the name of each stage ("mesh", then "write") when it starts.
+        The default value is None.
 
     Returns
     -------
-    None.
+    manifest : DICTIONARY
+        Folder of the exported files ("directory"), path of each written format ("files"),
+        seconds spent writing each one ("seconds") and seconds of the whole export ("total").
 
     """
+    start = time.perf_counter()
+    formats = [fileType, "sdf"] if formats is None else list(formats)
+    if not formats:
+        raise ValueError("No export format given")
+    unknown = [fmt for fmt in formats if fmt not in exportFormats]
+    if unknown:
+        raise ValueError(f"Unknown export formats: {unknown}")
+    meshTypes = [fmt for fmt in formats if fmt in meshFormats]
+    if "sdf" in formats and not meshTypes:
+        raise ValueError("The SDF file needs a mesh format to reference")
+    if collision is not None and collision not in collisionModes:
+        raise ValueError(f"Unknown collision mode: {collision}")
     # Create a mesh.
     size = len(pmap)
     height = int(zrat*size)
-    heightmap = np.array(pmap) * height
     filename = f"mesh{seed}_h{height}"
     print(f"Generating mesh with name {filename}...")
-    x = np.linspace(0, size, size)
-    y = np.linspace(0, size, size)
-    x, y = np.meshgrid(x, y)
-    vertices = np.column_stack((x.ravel(), y.ravel(), heightmap.ravel()))
-    # Generate the faces of the grid.
-    faces = []
-    rows, cols = heightmap.shape
-    for i in range(rows - 1):
-        for j in range(cols - 1):
-            # Indices of vertices in the flattened matrix.
-            idx1 = i * cols + j
-            idx2 = i * cols + (j + 1)
-            idx3 = (i + 1) * cols + j
-            idx4 = (i + 1) * cols + (j + 1)
-            # Two triangles per cell.
-            faces.append([idx1, idx2, idx3])
-            faces.append([idx2, idx4, idx3])
-    faces = np.array(faces)
-    mesh = trimesh.Trimesh(vertices = vertices, faces = faces)
+    if progress is not None:
+        progress("mesh")
+    vertices, faces = None, None
+    if mesh is not None:
+        vertices, faces = mesh.vertices, mesh.faces
+    elif meshTypes and mode != "grid" and "dae" not in meshTypes:
+        vertices, faces = meshArrays(pmap, height, mode, maxError)
+    elif meshTypes:
+        mesh = buildMesh(pmap, height, mode, maxError)
+        vertices, faces = mesh.vertices, mesh.faces
+    if stats and mesh is None and vertices is not None:
+        import trimesh
+        mesh = trimesh.Trimesh(vertices = vertices, faces = faces, process = False)
     # Generate a folder to store the mesh.
     print("Generating a folder to save the files.")
     # Generate a folder with the same name as the input file, without its extension.
-    current_path = os.getcwd()
+    current_path = os.getcwd() if outdir is None else outdir
     directory = os.path.join(current_path, filename)
     if not os.path.exists(directory):
         os.makedirs(directory)
-    print("\nApplying scale factor...")
-    mesh.apply_scale(scaling = 1.0)
-    print("Merging vertices closer than a pre-set constant...")
-    mesh.merge_vertices()
-    print("Removing duplicate faces...")
-    mesh.update_faces(mesh.unique_faces())
-    print("Making the mesh watertight...")
-    trimesh.repair.fill_holes(mesh)
-    trimesh.repair.fix_normals(mesh)
-    print("\nMesh volume: {}".format(mesh.volume))
-    print("Mesh convex hull volume: {}".format(mesh.convex_hull.volume))
-    print("Mesh bounding box volume: {}".format(mesh.bounding_box.volume))
-    # Export the DAE file.
-    print("\nGenerating the DAE mesh file...")
-    dae_file_path = os.path.join(directory, f"{filename}.dae")
-    #try:    
-    trimesh.exchange.export.export_mesh(
-        mesh = mesh,
-        file_obj = dae_file_path,
-        file_type = "dae")
-    print(f"Mesh exported successfully to {dae_file_path}")
-    # Generate the SDF file.
+    if stats and mesh is not None:
+        print("\nMesh volume: {}".format(mesh.volume))
+        print("Mesh convex hull volume: {}".format(mesh.convex_hull.volume))
+        print("Mesh bounding box volume: {}".format(mesh.bounding_box.volume))
+    paths = {fmt: os.path.join(directory, f"{filename}.{fmt}") for fmt in formats}
+
+    def writeSDFFile():
+        # Meshes are in pixel units, scaled to meters in the SDF file; boxes are scaled here,
+        # with the same factors, so that every geometry shares one frame.
+        scale = sdfScale(len_side, int(zrat*len_side), size, height)
+        # Simplified collision geometry.
+        collision_file_path, boxes = None, None
+        if collision == "decimated":
+            collision_file_path = os.path.join(directory, f"{filename}_collision.{meshTypes[0]}")
+            writeMeshFile(collision_file_path, meshTypes[0], *rtinMesh(np.asarray(pmap) * height, tolerance))
+            print(f"Collision mesh exported successfully to {collision_file_path}")
+        elif collision == "boxes":
+            boxes = obstacleBoxes(np.asarray(pmap) * height, tolerance)
+            boxes[:, [0, 1, 3, 4]] *= scale[0]
+            boxes[:, [2, 5]] *= scale[2]
+            print(f"{len(boxes)} collision boxes generated.")
+        WriteSDF(
+            directory = directory,
+            object_name = filename,
+            model_path = paths[meshTypes[0]],
+            length = len_side,
+            height = int(zrat*len_side),
+            extent = (size, height),
+            collision_path = collision_file_path,
+            collision_boxes = boxes)
+
+    def write(fmt):
+        # Write one format and time it.
+        begin = time.perf_counter()
+        if fmt in meshFormats:
+            writeMeshFile(paths[fmt], fmt, vertices, faces, mesh)
+        elif fmt == "sdf":
+            writeSDFFile()
+        elif fmt == "png":
+            writePNG(paths[fmt], np.rint(np.clip(np.asarray(pmap, dtype = float), 0, 1)*255).astype(np.uint8))
+        elif fmt == "npy":
+            np.save(paths[fmt], np.asarray(pmap))
+        print(f"{fmt.upper()} file exported successfully to {paths[fmt]}")
+        return fmt, time.perf_counter() - begin
+
+    print(f"\nGenerating the {', '.join(fmt.upper() for fmt in formats)} files...")
+    if progress is not None:
+        progress("write")
+    # The writers mostly wait on the disk, zlib and NumPy, which release the GIL.
+    with ThreadPoolExecutor(max_workers = len(formats)) as pool:
+        seconds = dict(pool.map(write, formats))
+    return {"directory": directory, "files": paths, "seconds": seconds, "total": time.perf_counter() - start}
+
+
+def WriteHeightmapSDF(directory, object_name, image_path, length = 60, height = 2):
+    """
+    This function is meant to write a SDF file using a Gazebo <heightmap> geometry instead of a mesh.
+
+    Parameters
+    ----------
+    directory : STRING
+        Folder where the SDF file is written.
+    object_name : STRING
+        Name used to save the exported object.
+    image_path : STRING
+        Path to find the 16-bit PNG heightmap (see meshExport.heightmapImage).
+    length : INTEGER, optional
+        Side length in meters. The default value is 60.
+    height : INTEGER, optional
+        Map height in meters. The default value is 2.
+
+    Returns
+    -------
+    None.
+
+    """
+    # The heightmap is centred on pos, which puts it on [0, length] like the exported meshes.
+    heightmap = f"""<heightmap>
+                                <uri>{image_path}</uri>
+                                <size>{length} {length} {height}</size>
+                                <pos>{length/2} {length/2} 0</pos>
+                            </heightmap>"""
+    sdf_model_file_text = \
+    f"""<?xml version='1.0'?>
+        <sdf version="1.6">
+            <model name="{object_name}">
+                <static>1</static>
+                <link name="link">
+                    <visual name="visual">
+                        <geometry>
+                            {heightmap}
+                        </geometry>
+                    </visual>
+                    <collision name="collision">
+                        <geometry>
+                            {heightmap}
+                        </geometry>
+                    </collision>
+                </link>
+            </model>
+        </sdf>"""
+    with open(f"{directory}/{object_name}.sdf", "w") as f:
+        f.write(sdf_model_file_text)
+
+
+def exportHeightmap(pmap, seed, len_side = 60, zrat = 2/60, side = None, outdir = None):
+    """
+    This function will export the given map as a Gazebo heightmap: a 16-bit grayscale PNG
+    of side 2^n + 1 and a SDF file with the matching <heightmap> element. No triangle is
+    built, so it is much faster and smaller than a mesh export.
+
+    Parameters
+    ----------
+    pmap : LIST
+        2D List of values of each pixel after conversion and scaling between 0 and 1.
+    seed : STRING
+        Combined seed of the map, see exportMesh.
+    len_side : INTEGER, optional
+        Side length in meters. The default value is 60.
+    zrat : FLOAT, optional
+        Ratio between height and side length. The default value is 2/60.
+    side : INTEGER, optional
+        Side of the image, 2^n + 1. The default value is None (smallest side >= map side).
+    outdir : STRING, optional
+        Folder in which the export folder is created. The default value is None (current folder).
+
+    Returns
+    -------
+    directory : STRING
+        Folder of the exported files.
+
+    """
+    size = len(pmap)
+    height = int(zrat*size)
+    filename = f"mesh{seed}_h{height}"
+    print(f"Generating heightmap with name {filename}...")
+    directory = os.path.join(os.getcwd() if outdir is None else outdir, filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    image = heightmapImage(pmap, side)
+    image_path = os.path.join(directory, f"{filename}.png")
+    writePNG(image_path, image)
+    print(f"Heightmap of side {len(image)} exported successfully to {image_path}")
+    print("Generating the SDF file...")
+    WriteHeightmapSDF(directory, filename, image_path, len_side, int(zrat*len_side))
+    return directory
+
+
+def WriteTiledSDF(directory, object_name, tiles, scale):
+    """
+    This function is meant to write a SDF file for a map exported in tiles, with one link
+    per tile, so that the simulator can cull and collide each tile on its own.
+
+    Parameters
+    ----------
+    directory : STRING
+        Folder where the SDF file is written.
+    object_name : STRING
+        Name used to save the exported object.
+    tiles : LIST
+        One (link name, path of the mesh file, x offset, y offset) tuple per tile, offsets in meters.
+    scale : TUPLE
+        Scale factors (x, y, z) from the pixel units of the meshes to meters.
+
+    Returns
+    -------
+    None.
+
+    """
+    sx, sy, sz = scale
+    links = ""
+    for name, model_path, x, y in tiles:
+        links += f"""
+                <link name="{name}">
+                    <pose>{x} {y} 0 0 0 0</pose>
+                    <visual name="visual">
+                        <geometry>
+                            <mesh>
+                                <uri>{model_path}</uri>
+                                <scale>{sx} {sy} {sz}</scale>
+                            </mesh>
+                        </geometry>
+                    </visual>
+                    <collision name="collision">
+                        <geometry>
+                            <mesh>
+                                <uri>{model_path}</uri>
+                                <scale>{sx} {sy} {sz}</scale>
+                            </mesh>
+                        </geometry>
+                    </collision>
+                </link>"""
+    sdf_model_file_text = \
+    f"""<?xml version='1.0'?>
+        <sdf version="1.6">
+            <model name="{object_name}">
+                <static>1</static>{links}
+            </model>
+        </sdf>"""
+    with open(f"{directory}/{object_name}.sdf", "w") as f:
+        f.write(sdf_model_file_text)
+
+
+def exportTile(path, fileType, tile, height, mode, maxError, stretch):
+    # Tile task of exportTiles: mesh one tile in its own frame and write it.
+    if mode == "grid":
+        heightmap = np.asarray(tile) * height
+        vertices, faces = gridVertices(heightmap), gridFaces(*heightmap.shape)
+    else:
+        vertices, faces = meshArrays(tile, height, mode, maxError, keepBorder = True)
+    vertices = vertices * np.array([stretch[0], stretch[1], 1.0], dtype = vertices.dtype)
+    writeMeshFile(path, fileType, vertices, faces)
+    return path
+
+
+def exportTiles(pmap, seed, tiles = 2, len_side = 60, zrat = 2/60, mode = "grid", maxError = 0.5, fileType = "glb", workers = 1, outdir = None):
+    """
+    This function will export the given map as tiles x tiles meshes, each one in its own
+    frame, and a SDF file with one link per tile placed at its offset. Meshes built on
+    pixels ("grid", "adaptive", "solid") share the pixels of their edges with their
+    neighbours, so the tiles join without gaps; "greedy" meshes are built on cells,
+    which are split between the tiles. The tiles are meshed and written in parallel.
+
+    Parameters
+    ----------
+    pmap : LIST
+        2D List of values of each pixel after conversion and scaling between 0 and 1.
+    seed : STRING
+        Combined seed of the map, see exportMesh.
+    tiles : INTEGER, optional
+        Number of tiles along each side. The default value is 2.
+    len_side : INTEGER, optional
+        Side length in meters. The default value is 60.
+    zrat : FLOAT, optional
+        Ratio between height and side length. The default value is 2/60.
+    mode : STRING, optional
+        Meshing mode of the tiles, one of meshModes. The "grid" tiles are not repaired.
+        The default value is "grid".
+    maxError : FLOAT, optional
+        Maximum vertical error of the "adaptive" mode. The default value is 0.5.
+    fileType : STRING, optional
+        Mesh file type, one of meshFormats. The default value is "glb".
+    workers : INTEGER, optional
+        Number of processes writing the tiles. The default value is 1.
+    outdir : STRING, optional
+        Folder in which the export folder is created. The default value is None (current folder).
+
+    Returns
+    -------
+    directory : STRING
+        Folder of the exported files.
+
+    """
+    if mode not in meshModes:
+        raise ValueError(f"Unknown mesh mode: {mode}")
+    if fileType not in meshFormats:
+        raise ValueError(f"Unknown mesh file type: {fileType}")
+    pmap = np.asarray(pmap)
+    size = len(pmap)
+    height = int(zrat*size)
+    filename = f"mesh{seed}_h{height}_t{tiles}"
+    print(f"Generating {tiles}x{tiles} tiles with name {filename}...")
+    directory = os.path.join(os.getcwd() if outdir is None else outdir, filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    cells = mode == "greedy"
+    # Pixel meshes span [0, size] over size - 1 steps, cell meshes one unit per cell.
+    step = 1.0 if cells else size/(size - 1)
+    edges = np.linspace(0, size if cells else size - 1, tiles + 1).round().astype(int)
+    tasks, links = [], []
+    for ty in range(tiles):
+        for tx in range(tiles):
+            i0, i1, j0, j1 = edges[ty], edges[ty + 1], edges[tx], edges[tx + 1]
+            tile = pmap[i0:i1 + (not cells), j0:j1 + (not cells)]
+            rows, cols = tile.shape
+            # Back from the own [0, cols] x [0, rows] span of the tile mesh to world pixel steps.
+            stretch = (step if cells else step*(cols - 1)/cols, step if cells else step*(rows - 1)/rows)
+            path = os.path.join(directory, f"{filename}_{tx}_{ty}.{fileType}")
+            tasks.append((path, fileType, tile, height, mode, maxError, stretch))
+            links.append((f"tile_{tx}_{ty}", path, j0*step*len_side/size, i0*step*len_side/size))
+    if workers <= 1:
+        for task in tasks:
+            exportTile(*task)
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            list(pool.map(exportTile, *zip(*tasks)))
+    print(f"{len(tasks)} tiles exported successfully to {directory}")
     print("Generating the SDF file...")
-    WriteSDF(
-        directory = directory,
-        object_name = filename,
-        model_path = dae_file_path,
-        length = len_side,
-        height = int(zrat*len_side))
-    #except:
-    #    print("\nUnable to export object.")
+    WriteTiledSDF(directory, filename, links, sdfScale(len_side, int(zrat*len_side), size, height))
+    return directory
+
+
+# Stages of a PerlinMap and what each one depends on, either parameters or upstream stages.
+# Setting a parameter only drops the stages downstream of it.
+stageDeps = {
+    "perlin": ("size", "seed1", "seed2", "oct1", "oct2", "backend"),
+    "normalized": ("perlin",),
+    "filter": ("size", "disparity", "filter_seed", "filter_res", "backend"),
+    "pmap": ("normalized", "filter", "density", "topography"),
+    "mesh": ("pmap", "height", "mesh_mode", "max_error"),
+    "figure_perlin": ("perlin",),
+    "figure_2d": ("pmap", "filter"),
+    "preview": ("size", "seed1", "seed2", "oct1", "oct2", "disparity", "filter_seed", "density", "topography"),
+    "figure_preview": ("preview",),
+    "figure_3d": ("pmap", "filter", "height"),
+}
 
 
 class PerlinMap():
     
-    def __init__(self, size = 600, seed1 = None, seed2 = None, oct1 = 20, oct2 = 20, density = "medium", topography = False, disparity = False, height = 20):
+    def __init__(self, size = 600, seed1 = None, seed2 = None, oct1 = 20, oct2 = 20, density = "medium", topography = False, disparity = False, height = 20, backend = "numpy", workers = 1, filter_seed = None, filter_res = None, mesh_mode = "grid", max_error = 0.5):
         """
-        Calling the constructor will automatically generate a map based on perlin noise
-        from all the given arguments.
+        The constructor stores the parameters of a map based on perlin noise.
+        The map is a lazy pipeline: each stage (raw noise, normalized field, density filter,
+        final map, mesh) is computed on first access and kept until a parameter it
+        depends on is changed with set_params.
 
         Parameters
         ----------
         size : INTEGER, optional
             Size of the square map in pixels. The default value is 600.
         seed1, seed2 : INTEGER, optional
-            Seeds used to generate Perlin noises. Default value is None.
+            Seeds used to generate Perlin noises. Default value is None (random).
         oct1, oct2 : INTEGER, optional
             Number of octaves (level of details) used to generate Perlin noises. Default value is 20.
         density : STRING (Default) or FLOAT, optional
@@ -356,58 +1084,379 @@ class PerlinMap():
             The default value is False (homogeneous distribution of motives).
         height : INTEGER, optional
             Height of the 3D map in pixel units. The default value is 20.
+        backend : STRING, optional
+            Noise backend, "numpy" (batched) or "perlin_noise" (reference, per pixel).
+            The default value is "numpy".
+        workers : INTEGER, optional
+            Number of processes used to generate the noise layers. The default value is 1.
+        filter_seed : INTEGER, optional
+            Seed of the density filter. Default value is None (random).
+        filter_res : INTEGER, optional
+            Side of the coarse grid of the density filter, e.g. 64 (see densityFilter).
+            Default value is None (full resolution).
+        mesh_mode : STRING, optional
+            Meshing mode of the exported mesh, one of meshModes (see buildMesh).
+            The default value is "grid".
+        max_error : FLOAT, optional
+            Maximum vertical error of the "adaptive" mesh, in pixel units. The default value is 0.5.
 
         Returns
         -------
         None.
         """
-        self.__size = size
-        self.__seed1 = seed1
-        self.__seed2 = seed2
-        self.__oct1 = oct1
-        self.__oct2 = oct2
-        self.__height = height
-        self.__zrat = height/size
-        self.__dens = density
-        self.__topo = topography
-        self.__disp = disparity
+        # Random seeds are drawn once, so that every stage of the map uses the same ones.
+        self.__params = {
+            "size": size,
+            "seed1": rd.randint(1, 1000) if seed1 is None else seed1,
+            "seed2": rd.randint(1001, 2000) if seed2 is None else seed2,
+            "oct1": oct1,
+            "oct2": oct2,
+            "density": density,
+            "topography": topography,
+            "disparity": disparity,
+            "filter_seed": rd.randint(2001, 3000) if filter_seed is None else filter_seed,
+            "filter_res": filter_res,
+            "height": height,
+            "backend": backend,
+            "workers": workers,
+            "mesh_mode": mesh_mode,
+            "max_error": max_error,
+        }
+        self.__stages = {}
+        self.__locks = {stage: threading.Lock() for stage in stageDeps}
+        # Each invalidation of a stage bumps its version: a result computed before is not stored.
+        self.__versions = dict.fromkeys(stageDeps, 0)
+        self.__paramLock = threading.Lock()
+
+    def set_params(self, **params):
+        """
+        Change some parameters of the map, dropping only the stages that depend on them.
+        For example, changing the density keeps the noise and only thresholds it again.
+        """
+        with self.__paramLock:
+            for name, value in params.items():
+                if name not in self.__params:
+                    raise KeyError(f"Unknown map parameter: {name}")
+                if self.__params[name] != value:
+                    self.__params[name] = value
+                    self.__invalidate(name)
+
+    def __invalidate(self, name):
+        for stage, deps in stageDeps.items():
+            if name in deps:
+                self.__stages.pop(stage, None)
+                self.__versions[stage] += 1
+                self.__invalidate(stage)
+
+    def __stage(self, stage):
+        # Compute a stage on first access, then serve it from memory. Callbacks of the Dash app
+        # may ask for the same map at once: each stage has its own lock, so a stage is computed
+        # only once, without holding up the others (e.g. the preview while the map is generated).
+        # Parameters changed meanwhile make the result stale: it is returned, but not stored.
+        with self.__locks[stage]:
+            try:
+                return self.__stages[stage]
+            except KeyError:
+                pass
+            with self.__paramLock:
+                version = self.__versions[stage]
+                p = dict(self.__params)
+            if stage == "perlin":
+                value = generPerlin(p["seed1"], p["seed2"], p["oct1"], p["oct2"], p["size"], p["backend"], p["workers"])
+            elif stage == "normalized":
+                value = normalizeArray(self.perlin)
+            elif stage == "filter":
+                value = densityFilter(p["size"], p["filter_seed"], p["backend"], p["workers"], p["filter_res"]) if p["disparity"] else (None, None)
+            elif stage == "pmap":
+                value = thresholdMap(self.normalized, p["density"], p["topography"], self.__stage("filter")[0])
+            elif stage == "mesh":
+                zrat = p["height"]/p["size"]
+                value = buildMesh(self.pmap, int(zrat*p["size"]), p["mesh_mode"], p["max_error"])  # Same height as exportMesh.
+            elif stage == "figure_perlin":
+                value = dispPerlin(self.perlin)
+            elif stage == "figure_2d":
+                value = disp2Dmap(self.pmap, self.__fullseed())
+            elif stage == "figure_3d":
+                value = disp3Dmap(self.pmap, self.__fullseed(), p["height"])
+            elif stage == "preview":
+                value = previewMap(p["size"], p["seed1"], p["seed2"], p["oct1"], p["oct2"], p["density"],
+                                   p["topography"], p["filter_seed"] if p["disparity"] else None)
+            elif stage == "figure_preview":
+                value = disp2Dmap(self.preview, self.__fullseed(), PREVIEW_STEP)
+            with self.__paramLock:
+                if self.__versions[stage] == version:
+                    self.__stages[stage] = value
+            return value
+
+    @property
+    def perlin(self):
+        return self.__stage("perlin")[0]
+
+    @property
+    def normalized(self):
+        return self.__stage("normalized")
+
+    @property
+    def density_filter(self):
+        return self.__stage("filter")[0]
+
+    @property
+    def pmap(self):
+        return self.__stage("pmap")
+
+    @property
+    def mesh(self):
+        return self.__stage("mesh")
+
+    @property
+    def preview(self):
+        # Coarse map, see previewMap: pixel (k, l) is pixel (k, l)*PREVIEW_STEP of pmap.
+        return self.__stage("preview")
+
+    def nbytes(self):
+        # Memory of the arrays of the computed stages (noise, filter, map, mesh); figures are not counted.
+        total = 0
+        for value in list(self.__stages.values()):
+            for item in value if isinstance(value, tuple) else (value,):
+                if isinstance(item, np.ndarray):
+                    total += item.nbytes
+                elif hasattr(item, "vertices") and hasattr(item, "faces"):
+                    total += item.vertices.nbytes + item.faces.nbytes
+        return total
+
+    def is_generated(self):
+        # Whether the full resolution map is already computed (then there is no need for a preview).
+        return "pmap" in self.__stages
+
+    def __fullseed(self):
+        seed = self.get_seed()
+        if self.__params["disparity"]:
+            seed += self.__stage("filter")[1]
+        seed += "T" if self.__params["topography"] else "F"
+        return seed
+
+    def __exportname(self):
+        # The seed alone does not tell maps apart: octaves, density and size are added.
+        p = self.__params
+        return f"{self.__fullseed()}_o{p['oct1']}-{p['oct2']}_d{p['density']}_s{p['size']}"
 
     def generate_perlin(self, seed1 = None, seed2 = None, oct1 = 20, oct2 = 20, size = 500):
-        (self.__perlin, self.__seed) = generPerlin(self.__seed1, self.__seed2, self.__oct1, self.__oct2, self.__size)
-        (self.__pmap, self.__fseed) = perlin2map(self.__perlin, self.__dens, self.__topo, self.__disp)
-        return self.__perlin, self.__seed
+        return self.perlin, self.get_seed()
     
+    # Figures are stages too: they are built once and shared by every caller (e.g. Dash callbacks).
+    def display_perlin(self):
+        return self.__stage("figure_perlin")
+
     def display_2d(self):
-        seed = self.__seed if self.__fseed == None else self.__seed+self.__fseed
-        seed += "T" if self.__topo else "F"
-        return disp2Dmap(self.__pmap, seed)
-
-    def display_3d(self):
-        seed = self.__seed if self.__fseed is None else self.__seed + self.__fseed
-        seed += "T" if self.__topo else "F"
-        return disp3Dmap(self.__pmap, seed, self.__height)
+        return self.__stage("figure_2d")
+
+    def display_preview(self):
+        return self.__stage("figure_preview")
+
+    def display_3d(self, window = None):
+        # A window (i0, i1, j0, j1) of the map is built on demand, the whole map is cached.
+        if window is None:
+            return self.__stage("figure_3d")
+        return disp3Dmap(self.pmap, self.__fullseed(), self.__params["height"], window = window)
     
-    def exportmesh(self, len_side = 60):
-        seed = self.__seed if self.__fseed == None else self.__seed+self.__fseed
-        seed += "T" if self.__topo else "F"
-        exportMesh(self.__pmap, seed, len_side, self.__zrat)
+    def exportmesh(self, len_side = 60, stats = False, file_type = "dae", tiles = 1, collision = None, tolerance = 2, heightmap = False,
+                   outdir = None, cache = None, formats = None, progress = None):
+        """
+        Export the map as a mesh (exportMesh, with the given formats), as tiles (tiles > 1,
+        exportTiles) or as a heightmap (exportHeightmap), and return the folder of the exported files.
+        progress, if given, is called with the name of each stage ("map", "mesh", "write") when it
+        starts; stages found in the cache are not reported.
+        With an exportCache.ExportCache, the export is keyed by a hash of every parameter of
+        the map and of the export and of the code version: a repeated export returns the
+        existing folder without generating the map again.
+        """
+        p = self.__params
+        if cache is not None:
+            options = {"len_side": len_side, "file_type": file_type, "tiles": tiles, "collision": collision,
+                       "tolerance": tolerance, "heightmap": heightmap, "formats": formats}
+            # The number of workers does not change the exported files, nor does the filter without disparity.
+            ignored = ("workers",) if p["disparity"] else ("workers", "filter_seed", "filter_res")
+            key_params = {name: value for name, value in p.items() if name not in ignored}
+            key_params.update(options)
+            directory, hit = cache.fetch(exportKey(key_params),
+                                         lambda folder: self.exportmesh(stats = stats, outdir = folder, progress = progress, **options),
+                                         key_params)
+            print(f"Export {'found in' if hit else 'added to'} the cache: {directory}")
+            return directory
+        if progress is not None:
+            progress("map")
+        pmap = self.pmap
+        if (heightmap or tiles > 1) and progress is not None:
+            # Meshing and writing are done tile by tile, or there is no mesh at all.
+            progress("write")
+        if heightmap:
+            return exportHeightmap(pmap, self.__exportname(), len_side, p["height"]/p["size"], outdir = outdir)
+        if tiles > 1:
+            return exportTiles(pmap, self.__exportname(), tiles, len_side, p["height"]/p["size"], p["mesh_mode"], p["max_error"],
+                               file_type, p["workers"], outdir)
+        # Binary formats of the modes built by construction skip the trimesh object entirely.
+        types = [file_type] if formats is None else [fmt for fmt in formats if fmt in meshFormats]
+        trimeshNeeded = "dae" in types or (types and p["mesh_mode"] == "grid")
+        mesh = None
+        if trimeshNeeded or "mesh" in self.__stages:
+            if progress is not None:
+                progress("mesh")
+                report = progress
+
+                def progress(stage):
+                    # The mesh is built here, exportMesh only reports the writing.
+                    if stage != "mesh":
+                        report(stage)
+            mesh = self.mesh
+        manifest = exportMesh(pmap, self.__exportname(), len_side, p["height"]/p["size"], mesh, p["mesh_mode"], p["max_error"], stats,
+                              file_type, collision, tolerance, outdir, formats, progress)
+        return manifest["directory"]
         
     def outperlin(self):
+        import matplotlib.pyplot as plt
         fig = plt.figure()
-        plt.imshow(self.__perlin, cmap = 'gray')
-        plt.title(f"Perlin noise generated with seed {self.__seed}.")
+        plt.imshow(self.perlin, cmap = 'gray')
+        plt.title(f"Perlin noise generated with seed {self.get_seed()}.")
         plt.gca().invert_yaxis()
         plt.show()
         return fig
     def get_seed(self):
-        seed = f"{self.__seed1}t{self.__seed2}"
+        seed = f"{self.__params['seed1']}t{self.__params['seed2']}"
         return seed
 
+    def save(self, path):
+        """
+        Save the parameters and the generated noise and map (and density filter) in a .npz file,
+        computing them first if needed, so that the map can be loaded later without generating it.
+        The map is stored compactly: one byte per pixel for a binary map, and single precision
+        for a topographic one.
+        """
+        arrays = {"perlin": self.perlin, "pmap": self.pmap.astype(np.float32 if self.__params["topography"] else np.uint8)}
+        if self.__params["disparity"]:
+            arrays["filter"] = self.density_filter
+        filterSeed = self.__stage("filter")[1] if self.__params["disparity"] else ""
+        # Written under another name then renamed, so that other processes never read a partial file.
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(f, params = json.dumps(self.__params), fseed = filterSeed, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a map saved with save: its stages are served from the file instead of being generated.
+        """
+        with np.load(path) as data:
+            perlin_map = cls(**json.loads(str(data["params"])))
+            perlin_map.__stages["perlin"] = (data["perlin"], perlin_map.get_seed())
+            perlin_map.__stages["pmap"] = data["pmap"].astype(np.float64)
+            if "filter" in data:
+                perlin_map.__stages["filter"] = (data["filter"], str(data["fseed"]))
+        return perlin_map
+
 
 
         
     def __str__(self):
-        topo = "ON" if self.__topo else "OFF"
-        disp = "ON" if self.__disp else "OFF"
-        return f"Map generated with seed {self.__seed}.\nSize (pixels): {self.__size}\nHeight (px-units): {self.__height}\nDensity: {self.__dens}\nTopography: {topo}\nDisparity: {disp}"
+        p = self.__params
+        topo = "ON" if p["topography"] else "OFF"
+        disp = "ON" if p["disparity"] else "OFF"
+        return f"Map generated with seed {self.get_seed()}.\nSize (pixels): {p['size']}\nHeight (px-units): {p['height']}\nDensity: {p['density']}\nTopography: {topo}\nDisparity: {disp}"
     
+
+
+
+# Default number of maps kept by mapCache, and their memory budget in bytes.
+MAP_CACHE_ENTRIES = 8
+MAP_CACHE_BYTES = 512*2**20
+
+
+class MapCache():
+
+    def __init__(self, maxEntries = MAP_CACHE_ENTRIES, maxBytes = MAP_CACHE_BYTES):
+        """
+        Least recently used cache of PerlinMap objects, keyed by
+        (seed1, seed2, oct1, oct2, size, density, topography, disparity). A cached map keeps
+        its computed stages, figures included, so asking again for the same parameters
+        returns at once.
+
+        Parameters
+        ----------
+        maxEntries : INTEGER, optional
+            Maximum number of maps kept. Least recently used maps are evicted beyond it,
+            and 0 disables the cache. The default value is MAP_CACHE_ENTRIES.
+        maxBytes : INTEGER, optional
+            Memory budget in bytes of the arrays of the cached maps (see PerlinMap.nbytes).
+            Stages are computed after a map is returned, so the maps are measured on each
+            get, and least recently used ones are evicted beyond it; the map returned is
+            always kept. The default value is MAP_CACHE_BYTES.
+
+        Returns
+        -------
+        None.
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.__maps = OrderedDict()
+        self.__lock = threading.Lock()  # Dash callbacks may run in several threads.
+
+    def get(self, seed1, seed2, oct1 = 20, oct2 = 20, size = 600, density = "medium", topography = False, disparity = False, path = None):
+        # A path keeps the map on disk across processes (see PerlinMap.save): the map is loaded
+        # from it if it exists, and generated then saved to it otherwise. A cached map that is
+        # not generated yet gives way to the file, saved meanwhile by another process.
+        key = (seed1, seed2, oct1, oct2, size, density, topography, disparity)
+        saved = path is not None and os.path.exists(path)
+        with self.__lock:
+            if key in self.__maps and not (saved and not self.__maps[key].is_generated()):
+                self.hits += 1
+                self.__maps.move_to_end(key)
+                self.__evict()
+                return self.__maps[key]
+            self.misses += 1
+        # Stages are computed lazily, outside of the lock, when the map is first used.
+        if saved:
+            perlin_map = PerlinMap.load(path)
+        else:
+            perlin_map = PerlinMap(size = size, seed1 = seed1, seed2 = seed2, oct1 = oct1, oct2 = oct2,
+                                   density = density, topography = topography, disparity = disparity)
+            if path is not None:
+                perlin_map.save(path)
+        with self.__lock:
+            if self.maxEntries > 0:
+                if key not in self.__maps or (saved and not self.__maps[key].is_generated()):
+                    self.__maps[key] = perlin_map
+                self.__maps.move_to_end(key)
+                perlin_map = self.__maps[key]
+                self.__evict()
+        return perlin_map
+
+    def __evict(self):
+        # Called with the lock held: drop least recently used maps beyond the number of maps or the budget.
+        while len(self.__maps) > self.maxEntries:
+            self.__maps.popitem(last = False)
+        sizes = [perlin_map.nbytes() for perlin_map in self.__maps.values()]
+        total = sum(sizes)
+        for size in sizes[:-1]:
+            if total <= self.maxBytes:
+                break
+            self.__maps.popitem(last = False)
+            total -= size
+
+    def clear(self):
+        with self.__lock:
+            self.__maps.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.__lock:
+            used = sum(perlin_map.nbytes() for perlin_map in self.__maps.values())
+        return {"hits": self.hits, "misses": self.misses, "maps": len(self.__maps), "maxEntries": self.maxEntries,
+                "bytes": used, "maxBytes": self.maxBytes}
+
+
+# Process-wide cache shared by the callbacks of the Dash app.
+mapCache = MapCache()
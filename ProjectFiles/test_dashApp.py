@@ -2,8 +2,17 @@
 # Purpose: To test the functions of the program
 
 import pytest
+import numpy as np
 from perlinMapGen import PerlinMap
 from FileProcess import PerlinFile
+from noiseEngine import noiseGrid, coarseGrid, layerCache, TOLERANCE, COARSE_TOLERANCE
+from worldGen import perlinTile, generWorld
+from exportCache import ExportCache
+from meshExport import gridVertices, gridFaces, greedyMesh, rtinMesh, solidMesh, obstacleBoxes, meshWriters
+from meshExport import heightmapImage, writePNG, encodePNG, lodGrid
+from perlinMapGen import generPerlin, generMap, perlin2map, normalize, exponentiate, binarize, formalize
+from perlinMapGen import normalizeArray, exponentiateArray, binarizeArray, formalizeArray
+from perlinMapGen import exportMesh, exportFormats, MapCache, WriteSDF
 
 
 # Test 1: File I/O
@@ -66,3 +75,528 @@ def test_map_export():
         print(f"Export failed: {e}")
         successful_export = False
     assert successful_export
+
+
+# Test 6: Vectorized noise backend reproduces perlin_noise
+def test_noise_backend_tolerance():
+    for seed, octaves in [(11, 1), (21, 14), (2500, 2)]:
+        fast = noiseGrid(seed, octaves, 40)
+        reference = noiseGrid(seed, octaves, 40, backend="perlin_noise")
+        assert np.abs(fast - reference).max() < TOLERANCE
+
+
+# Test 7: World tiles are seamless and match the in-memory map
+def test_world_tiles(tmp_path):
+    perlin, seed = generPerlin(11, 21, 1, 14, size=100)
+    tiles = [[perlinTile(tx, ty, 32, 11, 21, 1, 14, scale=100, worldSize=100) for ty in range(4)] for tx in range(4)]
+    assert np.array_equal(np.block(tiles), perlin)
+
+    info = generWorld(str(tmp_path), 100, tileSize=32, seed1=11, seed2=21, oct1=1, oct2=14, scale=100)
+    pmap, fseed = perlin2map(perlin)
+    assert np.array_equal(np.load(info["map"]), np.array(pmap))
+
+
+# Test 8: Parallel generation is bit-identical to the serial path
+def test_parallel_generation():
+    serial, seed = generPerlin(11, 21, 1, 14, size=120)
+    parallel, seed = generPerlin(11, 21, 1, 14, size=120, workers=2)
+    assert np.array_equal(serial, parallel)
+
+
+# Test 9: Layer cache reuses unchanged noise layers
+def test_layer_cache():
+    layerCache.clear()
+    first, seed = generPerlin(11, 21, 1, 14, size=80)
+    assert layerCache.stats()["misses"] == 2
+    # Only the second octave changes: the first layer comes from the cache.
+    second, seed = generPerlin(11, 21, 1, 15, size=80)
+    assert layerCache.hits == 1 and layerCache.misses == 3
+    uncached = noiseGrid(11, 1, 80, cache=False) + noiseGrid(21, 15, 80, cache=False).T
+    assert np.array_equal(second, uncached)
+
+
+# Test 10: Changing a parameter only recomputes the stages downstream of it
+def test_lazy_stages():
+    perlin_map = PerlinMap(size=100, seed1=11, seed2=21, oct1=1, oct2=14)
+    perlin, pmap = perlin_map.perlin, perlin_map.pmap
+    perlin_map.set_params(density="dense", topography=True)
+    assert perlin_map.perlin is perlin
+    assert perlin_map.pmap is not pmap
+    perlin_map.set_params(oct2=10)
+    assert perlin_map.perlin is not perlin
+
+
+# Test 11: Array-native helpers match the list-based API
+def test_array_helpers():
+    raw = np.random.default_rng(0).normal(size=(50, 50))
+    nper = normalizeArray(raw)
+    assert np.array_equal(nper, normalize(raw.tolist()))
+    efil = exponentiateArray(nper)
+    assert np.array_equal(efil, exponentiate(nper.tolist()))
+    assert np.array_equal(binarizeArray(nper, 0.3, efil), binarize(nper.tolist(), 0.3, efil.tolist()))
+    expected = formalize(nper.tolist(), 0.3)
+    assert np.array_equal(formalizeArray(nper, 0.3, out=nper), expected)
+
+
+# Test 12: Coarse density filter stays within its documented error bound
+def test_coarse_filter():
+    full = normalizeArray(noiseGrid(2500, 2, 300, cache=False))
+    coarse = normalizeArray(coarseGrid(2500, 2, 300, cache=False))
+    assert np.abs(full - coarse).max() < COARSE_TOLERANCE
+    perlin_map = PerlinMap(size=300, seed1=11, seed2=21, disparity=True, filter_seed=2500, filter_res=64)
+    assert perlin_map.pmap.shape == (300, 300)
+
+
+# Test 13: Fused map kernel matches the staged pipeline
+def test_fused_map():
+    for topography, disparity in [(False, False), (True, True)]:
+        pmap, seed, fseed = generMap(11, 21, 5, 14, 150, "medium", topography, disparity, filterSeed=2500, blockRows=64)
+        perlin, seed = generPerlin(11, 21, 5, 14, size=150)
+        expected, fseed = perlin2map(perlin, "medium", topography, disparity, filterSeed=2500)
+        assert np.array_equal(pmap, expected)
+
+
+# Test 14: Vectorized grid faces keep the former triangle order
+def test_grid_faces():
+    rows, cols = 4, 5
+    faces = gridFaces(rows, cols)
+    assert faces.dtype == np.uint32
+    assert faces.shape == (2*(rows - 1)*(cols - 1), 3)
+    # Second cell of the first row, then first cell of the second row.
+    assert faces[2].tolist() == [1, 2, 6] and faces[3].tolist() == [2, 7, 6]
+    assert faces[8].tolist() == [5, 6, 10] and faces[9].tolist() == [6, 11, 10]
+    assert gridVertices(np.zeros((rows, cols))).dtype == np.float32
+
+
+# Test 15: Greedy meshing of binary maps
+def test_greedy_mesh(tmp_path, monkeypatch):
+    heights = np.zeros((6, 6))
+    heights[1:4, 2:5] = 2
+    vertices, faces = greedyMesh(heights)
+    # 5 flat rectangles and 4 walls.
+    assert len(faces) == 18
+    perlin_map = PerlinMap(size=200, seed1=11, seed2=21, oct1=1, oct2=14, mesh_mode="greedy")
+    assert len(perlin_map.mesh.faces) < 2*199*199/10
+    assert (perlin_map.mesh.face_normals[:, 2] > -1e-9).all()
+    monkeypatch.chdir(tmp_path)
+    perlin_map.exportmesh(len_side=60)
+
+
+# Test 16: Adaptive mesh stays within its vertical error with far fewer triangles
+def test_adaptive_mesh():
+    size = 100
+    heights = PerlinMap(size=size, seed1=11, seed2=21, topography=True).pmap * 20
+    vertices, faces = rtinMesh(heights, maxError=0.5)
+    assert len(faces) < 2*(size - 1)**2/1.5
+    # Every triangle lies inside the map and faces up.
+    assert vertices[:, :2].min() >= 0 and vertices[:, :2].max() <= size
+    corners = vertices[faces].astype(float)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    assert (normals[:, 2] > 0).all()
+    # The triangles cover the map exactly once.
+    assert np.isclose(np.abs(normals[:, 2]).sum()/2, size*size)
+    # Vertical error at every pixel, interpolated in the triangle containing it.
+    xy = corners[:, :, :2]*(size - 1)/size
+    worst = 0
+    for i, j in np.ndindex(size, size):
+        if (i*size + j) % 7:
+            continue
+        p = np.array([j, i])
+        a, b = xy[:, [1, 2, 0]] - xy, p - xy
+        d = a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0]
+        inside = np.nonzero((d >= -1e-9).all(axis=1))[0][0]
+        w = d[inside][[1, 2, 0]]/d[inside].sum()
+        worst = max(worst, abs(w @ corners[inside, :, 2] - heights[i, j]))
+    assert worst <= 0.5 + 1e-6
+    perlin_map = PerlinMap(size=size, seed1=11, seed2=21, topography=True, mesh_mode="adaptive", max_error=2)
+    assert len(perlin_map.mesh.faces) < len(faces)
+
+
+# Test 17: Solid mesh is watertight and outward-facing without repair
+def test_solid_mesh(tmp_path, monkeypatch):
+    heights = np.arange(12.0).reshape(3, 4)
+    vertices, faces = solidMesh(heights, base=2)
+    assert len(faces) == 2*2*3 + 6*5
+    perlin_map = PerlinMap(size=50, seed1=11, seed2=21, topography=True, mesh_mode="solid")
+    mesh = perlin_map.mesh
+    assert mesh.is_watertight and mesh.is_winding_consistent
+    assert mesh.volume > 0
+    monkeypatch.chdir(tmp_path)
+    perlin_map.exportmesh(len_side=60)
+
+
+# Test 18: Binary writers round-trip through trimesh and are referenced by the SDF
+def test_binary_writers(tmp_path, monkeypatch):
+    import trimesh
+    vertices, faces = solidMesh(np.arange(20.0).reshape(4, 5))
+    for file_type, writer in meshWriters.items():
+        path = str(tmp_path / f"mesh.{file_type}")
+        writer(path, vertices, faces, block=7)
+        loaded = trimesh.load(path, force="mesh", process=False)
+        assert len(loaded.faces) == len(faces)
+        assert np.allclose(loaded.bounds, [vertices.min(axis=0), vertices.max(axis=0)])
+    perlin_map = PerlinMap(size=50, seed1=11, seed2=21, topography=True, mesh_mode="solid")
+    monkeypatch.chdir(tmp_path)
+    perlin_map.exportmesh(len_side=60, file_type="glb")
+    sdf = next(tmp_path.glob("mesh*/*.sdf")).read_text()
+    assert ".glb</uri>" in sdf
+
+
+# Test 19: Tiled export writes one mesh and one SDF link per tile, with shared edges
+def test_tiled_export(tmp_path, monkeypatch):
+    import re
+    import trimesh
+    monkeypatch.chdir(tmp_path)
+    perlin_map = PerlinMap(size=61, seed1=11, seed2=21, topography=True, mesh_mode="adaptive", workers=2)
+    perlin_map.exportmesh(len_side=61, file_type="ply", tiles=3)
+    sdf = next(tmp_path.glob("mesh*_t3/*.sdf")).read_text()
+    assert sdf.count("<link ") == 9
+    tiles = []
+    for x, y, uri in re.findall(r"<pose>(\S+) (\S+) 0 0 0 0</pose>\s*<visual.*?<uri>(.*?)</uri>", sdf, re.S):
+        tile = trimesh.load(uri, process=False)
+        tile.apply_translation([float(x), float(y), 0])
+        tiles.append(tile)
+    world = trimesh.util.concatenate(tiles)
+    world.merge_vertices(digits_vertex=3)
+    assert np.allclose(world.bounds[:, :2], [[0, 0], [61, 61]])
+    # Once the tiles are put together, only the outer border of the map is open.
+    edges, counts = np.unique(world.edges_sorted, axis=0, return_counts=True)
+    open_vertices = world.vertices[edges[counts == 1].ravel(), :2]
+    assert (np.isclose(open_vertices, 0) | np.isclose(open_vertices, 61)).any(axis=1).all()
+
+
+# Test 20: Simplified collision geometry is written next to the visual mesh
+def test_collision_geometry(tmp_path, monkeypatch):
+    heights = np.zeros((10, 10))
+    heights[2:5, 1:7] = 3
+    heights[7, 7] = 3
+    assert len(obstacleBoxes(heights)) == 2
+    # Coarser boxes still cover every obstacle.
+    boxes = obstacleBoxes(heights, tolerance=4)
+    covered = np.zeros((10, 10), dtype=bool)
+    for x0, y0, _, x1, y1, _ in boxes.astype(int):
+        covered[y0:y1, x0:x1] = True
+    assert covered[heights > 0].all()
+    monkeypatch.chdir(tmp_path)
+    binary_map = PerlinMap(size=60, seed1=11, seed2=21, mesh_mode="greedy")
+    binary_map.exportmesh(file_type="stl", collision="boxes", tolerance=3)
+    sdf = next(tmp_path.glob("mesh*F_*/*.sdf")).read_text()
+    assert "<box>" in sdf and sdf.count("<uri>") == 1
+    # Boxes are in meters, in the frame of the visual mesh once its <scale> is applied.
+    import re
+    import trimesh
+    scale = np.array(re.search(r"<scale>(\S+) (\S+) (\S+)</scale>", sdf).groups(), dtype=float)
+    visual = trimesh.load(next(tmp_path.glob("mesh*F_*/*.stl")), process=False).bounds * scale
+    sizes = np.array(re.findall(r"<size>(\S+) (\S+) (\S+)</size>", sdf), dtype=float)
+    poses = np.array(re.findall(r"<pose>(\S+) (\S+) (\S+) 0 0 0</pose>", sdf), dtype=float)
+    box_bounds = np.array([(poses - sizes/2).min(axis=0), (poses + sizes/2).max(axis=0)])
+    assert np.allclose(visual, [[0, 0, 0], [60, 60, 20]])
+    assert (box_bounds[0] >= visual[0] - 1e-9).all() and (box_bounds[1] <= visual[1] + 1e-9).all()
+    assert np.isclose(box_bounds[1, 2], visual[1, 2])
+    # The legacy positional call reads the extent of the mesh from the file.
+    stl = next(tmp_path.glob("mesh*F_*/*.stl"))
+    WriteSDF(str(tmp_path), "legacy", str(stl), 60, 20)
+    legacy = np.array(re.search(r"<scale>(\S+) (\S+) (\S+)</scale>", (tmp_path / "legacy.sdf").read_text()).groups(), dtype=float)
+    assert np.allclose(legacy, scale)
+    topo_map = PerlinMap(size=60, seed1=11, seed2=21, topography=True, mesh_mode="solid")
+    topo_map.exportmesh(file_type="glb", collision="decimated", tolerance=1)
+    sdf = next(tmp_path.glob("mesh*T_*/*.sdf")).read_text()
+    assert "_collision.glb</uri>" in sdf
+
+
+# Test 21: Heightmap export writes a 2^n+1 16-bit PNG and a <heightmap> SDF element
+def test_heightmap_export(tmp_path, monkeypatch):
+    from PIL import Image
+    heights = np.linspace(0, 1, 35).reshape(5, 7)
+    image = heightmapImage(heights)
+    assert image.shape == (9, 9) and image.dtype == np.uint16
+    # Corners stay in place, the first row of the image is the last row of the map.
+    assert image[0, 0] == round(heights[-1, 0]*65535) and image[-1, -1] == round(heights[0, -1]*65535)
+    writePNG(str(tmp_path / "image.png"), image)
+    assert (np.array(Image.open(tmp_path / "image.png")).astype(np.uint16) == image).all()
+    with pytest.raises(ValueError):
+        heightmapImage(heights, side=10)
+    monkeypatch.chdir(tmp_path)
+    perlin_map = PerlinMap(size=60, seed1=11, seed2=21, topography=True)
+    perlin_map.exportmesh(len_side=60, heightmap=True)
+    sdf = next(tmp_path.glob("mesh*/*.sdf")).read_text()
+    assert "<heightmap>" in sdf and "<pos>30.0 30.0 0</pos>" in sdf
+    assert Image.open(next(tmp_path.glob("mesh*/*.png"))).size == (65, 65)
+
+
+# Test 22: Export cache serves repeated exports and evicts the least recently used ones
+def test_export_cache(tmp_path, monkeypatch):
+    import os
+    monkeypatch.chdir(tmp_path)
+    # Maps differing only by their octaves or density get their own folders.
+    folders = {PerlinMap(size=40, seed1=11, seed2=21, oct1=oct1, density=density).exportmesh(file_type="stl")
+               for oct1 in (1, 2) for density in ("sparse", "dense")}
+    assert len(folders) == 4
+    cache = ExportCache(str(tmp_path / "cache"))
+    first = PerlinMap(size=40, seed1=11, seed2=21).exportmesh(file_type="glb", cache=cache)
+    again = PerlinMap(size=40, seed1=11, seed2=21).exportmesh(file_type="glb", cache=cache)
+    assert first == again and cache.hits == 1 and os.path.isdir(first)
+    other = PerlinMap(size=40, seed1=11, seed2=22).exportmesh(file_type="glb", cache=cache)
+    assert other != first and cache.stats()["entries"] == 2
+    # Beyond its budget, the cache only keeps the most recent export.
+    cache.maxBytes = 1
+    PerlinMap(size=40, seed1=11, seed2=23).exportmesh(file_type="glb", cache=cache)
+    assert cache.stats()["entries"] == 1 and not os.path.exists(first)
+
+
+# Test 23: Multi-format export writes every file from one mesh and times each one
+def test_multi_format_export(tmp_path):
+    import os
+    import trimesh
+    pmap = PerlinMap(size=50, seed1=11, seed2=21, topography=True).pmap
+    manifest = exportMesh(pmap, "11t21T", mode="solid", outdir=str(tmp_path), formats=exportFormats)
+    assert set(manifest["files"]) == set(exportFormats) == set(manifest["seconds"])
+    assert all(os.path.exists(path) for path in manifest["files"].values())
+    assert manifest["total"] >= max(manifest["seconds"].values())
+    obj = trimesh.load(manifest["files"]["obj"], process=False)
+    assert obj.is_watertight
+    assert np.array_equal(np.load(manifest["files"]["npy"]), pmap)
+    # The SDF file references the first mesh format of the list.
+    manifest = exportMesh(pmap, "11t21T", mode="solid", outdir=str(tmp_path), formats=["png", "ply", "sdf", "glb"])
+    assert manifest["files"]["ply"] in open(manifest["files"]["sdf"]).read()
+    with pytest.raises(ValueError):
+        exportMesh(pmap, "11t21T", outdir=str(tmp_path), formats=["sdf", "npy"])
+    # An empty list is rejected before any folder is created.
+    folders = set(os.listdir(tmp_path))
+    with pytest.raises(ValueError):
+        exportMesh(pmap, "empty", outdir=str(tmp_path), formats=[])
+    assert set(os.listdir(tmp_path)) == folders
+
+
+# Test 24: Map cache returns the same generated map and figures for the same parameters
+def test_map_cache():
+    cache = MapCache(maxEntries=2)
+    perlin_map = cache.get(seed1=11, seed2=21, oct1=1, oct2=14, size=100)
+    figure = perlin_map.display_2d()
+    assert cache.get(seed1=11, seed2=21, oct1=1, oct2=14, size=100) is perlin_map
+    assert perlin_map.display_2d() is figure and cache.hits == 1
+    # Other parameters make other maps, and the least recently used one is evicted.
+    assert cache.get(seed1=11, seed2=21, oct1=1, oct2=14, size=100, density="dense") is not perlin_map
+    cache.get(seed1=12, seed2=21, oct1=1, oct2=14, size=100)
+    assert cache.stats()["maps"] == 2
+    assert cache.get(seed1=11, seed2=21, oct1=1, oct2=14, size=100) is not perlin_map
+    # Changing the height only rebuilds the 3D figure.
+    figure_3d = perlin_map.display_3d()
+    perlin_map.set_params(height=10)
+    assert perlin_map.display_2d() is figure and perlin_map.display_3d() is not figure_3d
+    # Maps are also bounded by the memory of their arrays, measured on each get.
+    cache = MapCache(maxBytes=100*100*8)
+    first = cache.get(seed1=11, seed2=21, oct1=1, oct2=14, size=100)
+    assert first.nbytes() == 0 and first.pmap is not None
+    assert cache.stats()["bytes"] == first.nbytes() > cache.maxBytes
+    second = cache.get(seed1=12, seed2=21, oct1=1, oct2=14, size=100)
+    assert cache.stats()["maps"] == 1 and cache.get(seed1=12, seed2=21, oct1=1, oct2=14, size=100) is second
+
+
+# Test 25: Export reports its stages in order, once each
+def test_export_progress(tmp_path):
+    stages = []
+    perlin_map = PerlinMap(size=40, seed1=11, seed2=21)
+    perlin_map.exportmesh(file_type="glb", outdir=str(tmp_path), progress=stages.append)
+    assert stages == ["map", "mesh", "write"]
+    stages.clear()
+    perlin_map.exportmesh(heightmap=True, outdir=str(tmp_path), progress=stages.append)
+    assert stages == ["map", "write"]
+
+
+# Test 26: 3D figure fits the vertex budget, keeps every obstacle and zooms in full detail
+def test_3d_level_of_detail():
+    import plotly.io as pio
+    heights = np.zeros((100, 100))
+    heights[37, 58] = 1
+    x, y, coarse = lodGrid(heights, 400)
+    assert coarse.size <= 400 and coarse.shape == (len(y), len(x))
+    assert coarse.max() == 1 and x[0] == 2 and y[-1] == 97
+    perlin_map = PerlinMap(size=1000, seed1=11, seed2=21)
+    surface = perlin_map.display_3d().data[0]
+    assert surface.z.size <= 128*128 and surface.z.dtype == np.float32
+    assert len(pio.to_json(perlin_map.display_3d())) < 2**20
+    # A small window is shown cell for cell, at its place in the map.
+    surface = perlin_map.display_3d(window=(100, 200, 300, 350)).data[0]
+    assert np.array_equal(surface.z, perlin_map.pmap[100:200, 300:350]*20)
+    assert surface.x[0] == 300 and surface.y[0] == 100
+
+
+# Test 27: 2D figures are PNG image layers, 1-bit for binary maps, with hover coordinates
+def test_2d_image_figures():
+    import io
+    import base64
+    import plotly.io as pio
+    from PIL import Image
+    binary = np.random.default_rng(0).random((37, 53)) > 0.5
+    assert np.array_equal(np.array(Image.open(io.BytesIO(encodePNG(binary)))), binary)
+    perlin_map = PerlinMap(size=500, seed1=11, seed2=21)
+    figure = perlin_map.display_2d()
+    source = figure.data[0].source
+    png = base64.b64decode(source.split(",", 1)[1])
+    assert png[24] == 1  # bit depth of the IHDR chunk
+    assert np.array_equal(np.array(Image.open(io.BytesIO(png))), perlin_map.pmap == 1)
+    assert "%{x}" in figure.data[0].hovertemplate and "%{y}" in figure.data[0].hovertemplate
+    assert len(pio.to_json(figure)) < 50_000
+    image = np.array(Image.open(io.BytesIO(base64.b64decode(perlin_map.display_perlin().data[0].source.split(",", 1)[1]))))
+    assert image.dtype == np.uint8 and image.min() == 0 and image.max() == 255
+
+
+# Test 28: Each figure is rendered from the published map by its own callback, the 3D one only when shown
+def test_split_figure_callbacks(tmp_path, monkeypatch):
+    import dash
+    import dashAppPerlin as app
+    monkeypatch.chdir(tmp_path)
+    data = {'size': 100, 'seed1': 11, 'seed2': 21, 'oct1': 1, 'oct2': 14}
+    perlin_map = app.stored_map(data)
+    assert app.stored_map(dict(data)) is perlin_map
+    figure = app.render_2d(data)
+    assert figure.layout.title.text == "2D Perlin Map" and perlin_map.display_2d().layout.title.text != "2D Perlin Map"
+    assert app.render_perlin(data).data[0].source == perlin_map.display_perlin().data[0].source
+    figure_3d, style = app.render_3d(data, [])
+    assert figure_3d is dash.no_update and style['display'] == 'none'
+    figure_3d, style = app.render_3d(data, ["show_3d"])
+    assert figure_3d.data[0].z.shape == perlin_map.pmap.shape and style['display'] == 'flex'
+
+
+# Test 29: Preview samples the same noise as the full map, one pixel out of PREVIEW_STEP
+def test_progressive_preview():
+    from perlinMapGen import previewMap, PREVIEW_STEP
+    perlin_map = PerlinMap(size=400, seed1=11, seed2=21)
+    preview = perlin_map.preview
+    assert preview.shape == (400//PREVIEW_STEP, 400//PREVIEW_STEP) and not perlin_map.is_generated()
+    assert perlin_map.display_preview().data[0].dx == PREVIEW_STEP
+    assert np.mean(preview == perlin_map.pmap[::PREVIEW_STEP, ::PREVIEW_STEP]) > 0.98
+    assert perlin_map.is_generated()
+    # Raw noise samples are exact, only the normalization range is estimated.
+    raw = previewMap(100, 11, 21, step=3, density=1.0)
+    assert raw.shape == (34, 34)
+    nper = normalizeArray(PerlinMap(size=100, seed1=11, seed2=21).perlin[::3, ::3])
+    assert np.array_equal(raw, binarizeArray(nper, 1.0))
+
+
+# Test 30: Fast startup, heavy modules imported on first use and the initial map loaded from its file
+def test_lazy_startup(tmp_path, monkeypatch):
+    import os
+    import sys
+    import subprocess
+    import warnings
+    code = "import sys, perlinMapGen; print(sorted({'matplotlib', 'trimesh', 'perlin_noise'} & set(sys.modules)))"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout.strip() == "[]"
+    # A saved map is loaded as it was, without generating it again.
+    perlin_map = MapCache().get(seed1=11, seed2=21, size=100, disparity=True, path=str(tmp_path / "map.npz"))
+    loaded = MapCache().get(seed1=11, seed2=21, size=100, disparity=True, path=str(tmp_path / "map.npz"))
+    assert np.array_equal(loaded.pmap, perlin_map.pmap) and np.array_equal(loaded.perlin, perlin_map.perlin)
+    assert loaded.display_2d().layout.title.text == perlin_map.display_2d().layout.title.text
+    import dashAppPerlin as app
+    monkeypatch.chdir(tmp_path)
+    # Creating the app neither loads nor generates the initial map, serving the page does.
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        dash_app = app.create_app()
+    # Generation and export are jobs of the app manager, or plain callbacks with a warning without it.
+    jobs = [output for output, spec in dash_app.callback_map.items() if spec.get("background")]
+    assert len(jobs) == 2 if not caught else not jobs and "dash[diskcache]" in str(caught[0].message)
+    client = dash_app.server.test_client()
+    assert app.map_path(app.initParams) is None
+    assert client.get('/_dash-layout').status_code == 200
+    assert os.path.exists(app.map_path(app.initParams))
+
+
+# Test 31: Export cache serves other entries during a build and keeps the first of concurrent builds
+def test_export_cache_concurrency(tmp_path, monkeypatch):
+    import os
+    import exportCache
+    cache = ExportCache(str(tmp_path / "cache"))
+
+    def write(folder, text):
+        with open(os.path.join(folder, "file.txt"), "w") as f:
+            f.write(text)
+        return os.path.join(folder, "file.txt")
+    cached, _ = cache.fetch("a", lambda folder: write(folder, "a"))
+    # No lock is held during a build, so cached entries are served meanwhile.
+    inner = []
+    cache.fetch("b", lambda folder: inner.append(cache.get("a")) or write(folder, "b"))
+    assert inner == [cached]
+
+    # A build published second (e.g. by another process) gives way to the first one.
+    def race(folder):
+        cache.fetch("c", lambda other: write(other, "first"))
+        return write(folder, "second")
+    path, hit = cache.fetch("c", race)
+    assert open(path).read() == "first" and not hit
+    assert sorted(os.listdir(tmp_path / "cache" / "c")) == sorted([exportCache.MANIFEST, os.path.basename(os.path.dirname(path))])
+    # Folders of interrupted builds are removed once stale, published ones are kept.
+    os.makedirs(tmp_path / "cache" / "d" / "123-456")
+    os.makedirs(tmp_path / "cache" / "c" / "789-0")
+    monkeypatch.setattr(exportCache, "STALE_BUILD_SECONDS", -1)
+    cache.fetch("e", lambda folder: write(folder, "e"))
+    assert not (tmp_path / "cache" / "d").exists() and not (tmp_path / "cache" / "c" / "789-0").exists()
+    assert open(cache.get("c")).read() == "first" and open(cache.get("a")).read() == "a"
+
+
+
+# Test 32: The map generated by update_graph (possibly in a job process) is saved and loaded by the renders
+def test_published_map(tmp_path, monkeypatch):
+    import os
+    import dashAppPerlin as app
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+    monkeypatch.chdir(tmp_path)
+    context_value.set(AttributeDict(triggered_inputs=[{'prop_id': 'generate-manual-button.n_clicks', 'value': 1}]))
+    data = app.update_graph(lambda value: None, 0, 1, None, 7, 1007, 1, 14, 120, False, False)[3]
+    assert os.path.exists(app.map_path(data))
+    # The map is stored in one byte per pixel.
+    with np.load(app.map_path(data)) as saved:
+        assert saved["pmap"].dtype == np.uint8
+    # A server process that did not run the job loads the map instead of generating it again.
+    app.mapCache.clear()
+    layerCache.clear()
+    perlin_map = app.stored_map(data)
+    assert perlin_map.is_generated() and layerCache.stats()["misses"] == 0
+    assert app.render_2d(data).data[0].source and layerCache.stats()["misses"] == 0
+    # A map created meanwhile (e.g. for the preview) gives way to the saved one.
+    app.mapCache.clear()
+    preview_map = app.mapCache.get(**data)
+    preview_map.preview
+    assert app.stored_map(data) is not preview_map and app.stored_map(data).is_generated()
+    # Least recently used maps are removed beyond the disk budget, the last one saved is kept.
+    app.map_store().maxBytes = 0
+    other = dict(data, seed1=8)
+    app.stored_map(other)
+    assert app.map_path(data) is None and os.path.exists(app.map_path(other))
+
+
+# Test 33: Callbacks asking for the same map at once compute each stage only once
+def test_concurrent_stages():
+    from concurrent.futures import ThreadPoolExecutor
+    layerCache.clear()
+    perlin_map = PerlinMap(size=300, seed1=13, seed2=1013)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        figures = list(pool.map(lambda show: show(), [perlin_map.display_perlin, perlin_map.display_2d,
+                                                      perlin_map.display_3d, perlin_map.display_2d]))
+    assert figures[1] is figures[3]
+    assert layerCache.stats()["misses"] == 2  # One per noise layer
+
+
+# Test 34: A stage computed while its parameters change is not kept
+def test_stale_stage(monkeypatch):
+    import threading
+    import perlinMapGen
+    perlin_map = PerlinMap(size=60, seed1=11, seed2=21)
+    perlin_map.perlin
+    started, resume = threading.Event(), threading.Event()
+    threshold = perlinMapGen.thresholdMap
+
+    def slow_threshold(*args, **kwargs):
+        started.set()
+        resume.wait()
+        return threshold(*args, **kwargs)
+    monkeypatch.setattr(perlinMapGen, "thresholdMap", slow_threshold)
+    worker = threading.Thread(target=lambda: perlin_map.pmap)
+    worker.start()
+    started.wait()
+    perlin_map.set_params(density="dense")
+    resume.set()
+    worker.join()
+    assert np.array_equal(perlin_map.pmap, PerlinMap(size=60, seed1=11, seed2=21, density="dense").pmap)
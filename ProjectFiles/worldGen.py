@@ -0,0 +1,190 @@
+# Description: Tiled generation of maps far larger than memory. Noise is evaluated in global
+# world coordinates, so any tile (tx, ty) can be produced on its own and matches its neighbours
+# exactly at the seams. Tiles are streamed one at a time into .npy files on disk.
+
+
+import json
+import os
+import random as rd
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from noiseEngine import GradientNoise
+from perlinMapGen import denstags, normalizeArray, exponentiateArray, binarizeArray, formalizeArray
+
+
+def tileBounds(tx, ty, tileSize, worldSize):
+    """
+    Pixel bounds (i0, i1, j0, j1) of tile (tx, ty). Tiles on the last row or column
+    are clipped to the world size.
+    """
+    i0, j0 = tx*tileSize, ty*tileSize
+    return i0, min(i0 + tileSize, worldSize), j0, min(j0 + tileSize, worldSize)
+
+
+def perlinTile(tx, ty, tileSize, seed1, seed2, oct1 = 20, oct2 = 20, scale = 600, worldSize = None):
+    """
+    This function will generate one tile of the superposed perlin noise of a world,
+    evaluated in world coordinates (pixel (i, j) sits at (i/scale, j/scale)).
+
+    Parameters
+    ----------
+    tx, ty : INTEGER
+        Tile indices along the first and second axis.
+    tileSize : INTEGER
+        Side length of a tile in pixels.
+    seed1, seed2 : INTEGER
+        Seeds of the two superposed noises.
+    oct1, oct2 : INTEGER, optional
+        Number of octaves per world unit. Default value is 20.
+    scale : INTEGER, optional
+        Number of pixels per world unit. With scale = size, a single tile of size pixels
+        is exactly the map returned by generPerlin. The default value is 600.
+    worldSize : INTEGER, optional
+        Side length of the world, used to clip the last tiles. Default value is None (no clipping).
+
+    Returns
+    -------
+    tile : NUMPY ARRAY
+        Raw noise values of the tile.
+    """
+    worldSize = (max(tx, ty) + 1)*tileSize if worldSize is None else worldSize
+    i0, i1, j0, j1 = tileBounds(tx, ty, tileSize, worldSize)
+    rows = np.arange(i0, i1)/scale
+    cols = np.arange(j0, j1)/scale
+    subpic = GradientNoise(octaves = oct1, seed = seed1).sample(rows[:, None], cols[None, :])
+    # The second noise is transposed, as in generPerlin.
+    suppic = GradientNoise(octaves = oct2, seed = seed2).sample(cols[:, None], rows[None, :])
+    return subpic + suppic.T
+
+
+def filterTile(tx, ty, tileSize, fseed, scale = 600, worldSize = None):
+    """
+    This function will generate one tile of the density filter noise (2 octaves per world unit).
+    """
+    worldSize = (max(tx, ty) + 1)*tileSize if worldSize is None else worldSize
+    i0, i1, j0, j1 = tileBounds(tx, ty, tileSize, worldSize)
+    rows = np.arange(i0, i1)/scale
+    cols = np.arange(j0, j1)/scale
+    return GradientNoise(octaves = 2, seed = fseed).sample(rows[:, None], cols[None, :])
+
+
+def writeRawTile(perlinPath, filterPath, tx, ty, tileSize, worldSize, seed1, seed2, oct1, oct2, scale, fseed):
+    # Tile task of the first pass: write raw noise (and filter) tiles, return their extrema.
+    i0, i1, j0, j1 = tileBounds(tx, ty, tileSize, worldSize)
+    tile = perlinTile(tx, ty, tileSize, seed1, seed2, oct1, oct2, scale, worldSize)
+    raw = np.load(perlinPath, mmap_mode = "r+")
+    raw[i0:i1, j0:j1] = tile
+    raw.flush()
+    extrema = [tile.min(), tile.max(), None, None]
+    if filterPath is not None:
+        ftile = filterTile(tx, ty, tileSize, fseed, scale, worldSize)
+        filt = np.load(filterPath, mmap_mode = "r+")
+        filt[i0:i1, j0:j1] = ftile
+        filt.flush()
+        extrema[2:] = [ftile.min(), ftile.max()]
+    return extrema
+
+
+def writeMapTile(perlinPath, filterPath, mapPath, tx, ty, tileSize, worldSize, bounds, fbounds, dens, topography):
+    # Tile task of the second pass: normalize a raw tile with the world range and threshold it.
+    i0, i1, j0, j1 = tileBounds(tx, ty, tileSize, worldSize)
+    nper = normalizeArray(np.load(perlinPath, mmap_mode = "r")[i0:i1, j0:j1], bounds)
+    efil = None
+    if filterPath is not None:
+        efil = normalizeArray(np.load(filterPath, mmap_mode = "r")[i0:i1, j0:j1], fbounds)
+        exponentiateArray(efil, out = efil)
+    pmap = np.load(mapPath, mmap_mode = "r+")
+    pmap[i0:i1, j0:j1] = formalizeArray(nper, dens, efil, nper) if topography else binarizeArray(nper, dens, efil, nper)
+    pmap.flush()
+
+
+def runTasks(task, argsList, workers = 1):
+    # Run the tile tasks in order, or spread them over a pool of processes.
+    if workers <= 1:
+        return [task(*args) for args in argsList]
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(task, *zip(*argsList)))
+
+
+def generWorld(directory, worldSize, tileSize = 1024, seed1 = None, seed2 = None, oct1 = 20, oct2 = 20,
+               scale = 600, density = "medium", topography = False, disparity = False, workers = 1):
+    """
+    This function will generate a world map of worldSize x worldSize pixels, tile by tile.
+    The raw noise is written to "perlin.npy" and the final map to "map.npy" in the given
+    directory, both as memory-mapped arrays, so peak memory is bounded by the tile size.
+    Global normalization needs the range of the whole world: a first pass writes the raw
+    tiles and records their extrema, a second pass reads them back and thresholds them.
+
+    Parameters
+    ----------
+    directory : STRING
+        Folder where the world files are written (created if needed).
+    worldSize : INTEGER
+        Side length of the square world in pixels.
+    tileSize : INTEGER, optional
+        Side length of a tile in pixels. The default value is 1024.
+    seed1, seed2 : INTEGER, optional
+        Seeds used to generate Perlin noises. Default value is None (random).
+    oct1, oct2 : INTEGER, optional
+        Number of octaves per world unit. Default value is 20.
+    scale : INTEGER, optional
+        Number of pixels per world unit. The default value is 600.
+    density : STRING (Default) or FLOAT, optional
+        Density option label (low = "sparse", "medium", high = "dense").
+        The default option is "medium".
+    topography : BOOLEAN, optional
+        Boolean indicating whether the output should include uneven ground.
+        The default value is False (binary map).
+    disparity : BOOLEAN, optional
+        Boolean indicating whether the outputted map should feature spatial disparities.
+        The default value is False (homogeneous distribution of motives).
+    workers : INTEGER, optional
+        Number of processes sharing the tiles. Each one writes its tiles straight into
+        the files on disk. The default value is 1.
+
+    Returns
+    -------
+    info : DICTIONARY
+        Parameters of the world, seed and paths of the written files. It is also saved
+        as "world.json" in the directory.
+    """
+    if seed1 is None:
+        seed1 = rd.randint(1, 1000)
+    if seed2 is None:
+        seed2 = rd.randint(1001, 2000)
+    dens = denstags[density] if density in denstags else density
+    fseed = rd.randint(2001, 3000) if disparity else None
+    os.makedirs(directory, exist_ok = True)
+    ntiles = -(-worldSize//tileSize)
+    tiles = [(tx, ty) for tx in range(ntiles) for ty in range(ntiles)]
+    perlinPath = os.path.join(directory, "perlin.npy")
+    filterPath = os.path.join(directory, "filter.npy") if disparity else None
+    mapPath = os.path.join(directory, "map.npy")
+    # The files are created here, tasks only reopen them to write their own tile.
+    shape = (worldSize, worldSize)
+    np.lib.format.open_memmap(perlinPath, mode = "w+", dtype = np.float64, shape = shape).flush()
+    if disparity:
+        np.lib.format.open_memmap(filterPath, mode = "w+", dtype = np.float64, shape = shape).flush()
+    np.lib.format.open_memmap(mapPath, mode = "w+", dtype = np.float64 if topography else np.uint8, shape = shape).flush()
+    # First pass: raw noise tiles and their extrema.
+    rawTasks = [(perlinPath, filterPath, tx, ty, tileSize, worldSize, seed1, seed2, oct1, oct2, scale, fseed)
+                for tx, ty in tiles]
+    extrema = runTasks(writeRawTile, rawTasks, workers)
+    bounds = (min(e[0] for e in extrema), max(e[1] for e in extrema))
+    fbounds = (min(e[2] for e in extrema), max(e[3] for e in extrema)) if disparity else None
+    # Second pass: normalize each tile with the world range and threshold it.
+    mapTasks = [(perlinPath, filterPath, mapPath, tx, ty, tileSize, worldSize, bounds, fbounds, dens, topography)
+                for tx, ty in tiles]
+    runTasks(writeMapTile, mapTasks, workers)
+    if disparity:
+        os.remove(filterPath)
+    seed = f"{seed1}t{seed2}" if fseed is None else f"{seed1}t{seed2}f{fseed}"
+    info = {"seed": seed, "seed1": seed1, "seed2": seed2, "fseed": fseed, "oct1": oct1, "oct2": oct2,
+            "worldSize": worldSize, "tileSize": tileSize, "scale": scale, "density": density,
+            "topography": topography, "bounds": [float(b) for b in bounds],
+            "perlin": perlinPath, "map": mapPath}
+    with open(os.path.join(directory, "world.json"), "w") as f:
+        json.dump(info, f, indent = 4)
+    print(f"World of size {worldSize} generated with seed {seed} in {len(tiles)} tiles.")
+    return info
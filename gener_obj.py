@@ -1,6 +1,7 @@
 import random as rd
 import numpy as np
 import trimesh
+from ProjectFiles.meshExport import gridVertices, gridFaces
 import matplotlib.pyplot as plt
 from perlin_noise import PerlinNoise
 
@@ -70,31 +71,11 @@ height = 10
 #heightmap = np.random.rand(50, 50) * 10  # 50x50 with heights between 0 and 10
 heightmap = np.array(divbmap)*height
 
-size = heightmap.shape[0]
-# Generate a grid for the x, y coordinates
-x = np.linspace(0, size, size)
-y = np.linspace(0, size, size)
-x, y = np.meshgrid(x, y)
-
-# Convert to 3D points
-vertices = np.column_stack((x.ravel(), y.ravel(), heightmap.ravel()))
-
-# Generate the faces of the grid
-faces = []
-rows, cols = heightmap.shape
-for i in range(rows - 1):
-    for j in range(cols - 1):
-        # Indices of vertices in the flattened matrix
-        idx1 = i * cols + j
-        idx2 = i * cols + (j + 1)
-        idx3 = (i + 1) * cols + j
-        idx4 = (i + 1) * cols + (j + 1)
-
-        # Two triangles per cell
-        faces.append([idx1, idx2, idx3])
-        faces.append([idx2, idx4, idx3])
-
-faces = np.array(faces)
+# Convert the grid to 3D points
+vertices = gridVertices(heightmap)
+
+# Generate the faces of the grid, two triangles per cell
+faces = gridFaces(*heightmap.shape)
 
 # Create a mesh
 mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
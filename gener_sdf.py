@@ -7,6 +7,7 @@
 import os
 import trimesh
 import numpy as np
+from ProjectFiles.meshExport import gridVertices, gridFaces
 
 
 def WriteSDF(directory, object_name, model_path, length = 60, height = 2):
@@ -49,24 +50,9 @@ def exportMesh(pmap, seed, len_side = 60, zrat = 2/60):
     heightmap = np.array(pmap) * height
     filename = f"mesh{seed}_h{height}"
     print(f"Generating mesh with name {filename}...")
-    x = np.linspace(0, size, size)
-    y = np.linspace(0, size, size)
-    x, y = np.meshgrid(x, y)
-    vertices = np.column_stack((x.ravel(), y.ravel(), heightmap.ravel()))
+    vertices = gridVertices(heightmap)
     # Generate the faces of the grid.
-    faces = []
-    rows, cols = heightmap.shape
-    for i in range(rows - 1):
-        for j in range(cols - 1):
-            # Indices of vertices in the flattened matrix.
-            idx1 = i * cols + j
-            idx2 = i * cols + (j + 1)
-            idx3 = (i + 1) * cols + j
-            idx4 = (i + 1) * cols + (j + 1)
-            # Two triangles per cell.
-            faces.append([idx1, idx2, idx3])
-            faces.append([idx2, idx4, idx3])
-    faces = np.array(faces)
+    faces = gridFaces(*heightmap.shape)
     mesh = trimesh.Trimesh(vertices = vertices, faces = faces)
     # Generate a folder to store the mesh.
     print("Generating a folder to save the files.")
@@ -1,5 +1,6 @@
-from perlin_noise import PerlinNoise
+from ProjectFiles.noiseEngine import GradientNoise
 from random import randint
+import numpy as np
 
 
 def generatePerlin(seed=None, noct=None, xDim=100, yDim=100):
@@ -17,8 +18,8 @@ def generatePerlin(seed=None, noct=None, xDim=100, yDim=100):
     if noct is None:
         noct = 20 # Default Num
 
-    noise = PerlinNoise(octaves = noct, seed = seed)
-    pic = [[noise([i/xDim, j/yDim]) for j in range(xDim)] for i in range(yDim)]
+    noise = GradientNoise(octaves = noct, seed = seed)
+    pic = noise.sample(np.arange(yDim)[:, None]/xDim, np.arange(xDim)[None, :]/yDim).tolist()
 
     binarpic = []
     for row in pic:  # Convert smooth map into binary map, using a threshold of 0.7.
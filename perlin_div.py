@@ -4,7 +4,7 @@
 # featuring a wide disparity in the distribution of motives.
 
 import matplotlib.pyplot as plt
-from perlin_noise import PerlinNoise
+from ProjectFiles.noiseEngine import GradientNoise, coarseGrid
 import random as rd
 import numpy as np
 
@@ -39,13 +39,12 @@ size = 400
 s1 = rd.randint(1, 1000)
 s2 = rd.randint(1001, 2000)
 s3 = rd.randint(2001,3000)
-noise1 = PerlinNoise(octaves = 20, seed = s1)
-noise2 = PerlinNoise(octaves = 20, seed = s2)
-noise3 = PerlinNoise(octaves = 2, seed = s3)
-subpic = [[noise1([i/size, j/size]) for j in range(size)] for i in range(size)]
-suppic = [[noise2([i/size, j/size]) for j in range(size)] for i in range(size)]
-divpic = [[noise3([i/size, j/size]) for j in range(size)] for i in range(size)]
-perlin = [[subpic[i][j]+suppic[j][i] for j in range(size)] for i in range(size)]
+noise1 = GradientNoise(octaves = 20, seed = s1)
+noise2 = GradientNoise(octaves = 20, seed = s2)
+subpic = noise1.grid(size)
+suppic = noise2.grid(size)
+divpic = coarseGrid(s3, 2, size).tolist()  # Low frequency filter, evaluated on a coarse grid and upsampled.
+perlin = (subpic + suppic.T).tolist()
 
 
 normperlin = normalMap(perlin)
@@ -5,7 +5,7 @@
 
 
 import matplotlib.pyplot as plt
-from perlin_noise import PerlinNoise
+from ProjectFiles.noiseEngine import GradientNoise
 from random import randint
 
 noct = 20  # A higher number of octaves will generate smaller patterns.
@@ -16,8 +16,8 @@ nseed = randint(1,1000)  # Random integer to define the seed.
 xpix, ypix = 600, 600  # Definition in pixels of the perlin map.
 # Square maps are preferred.
 
-noise = PerlinNoise(octaves = noct, seed = nseed)
-pic = [[noise([i/xpix, j/ypix]) for j in range(xpix)] for i in range(ypix)]
+noise = GradientNoise(octaves = noct, seed = nseed)
+pic = noise.grid(xpix).tolist()
 
 topopic = []
 for row in pic:  # Convert smooth map into topographic map, using a threshold of 0.65.